@@ -0,0 +1,318 @@
+import argparse
+import ipaddress
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# 记录调用的桩程序：每次执行向 CNWALL_BENCH_LOG 追加一行，并吞掉 `nft -f -` / `ipset restore` 的标准输入
+STUB = """#!/bin/sh
+echo "$(basename "$0") $*" >> "$CNWALL_BENCH_LOG"
+case "$*" in *"-f -"*|*restore*) cat > /dev/null;; esac
+exit 0
+"""
+STUBS = ("nft", "ipset", "ufw", "ufw-docker", "docker", "crontab")
+
+# expanded 布局的规则数为 端口 × 协议 × CIDR，超大组合会生成数百万条规则，只在 compact 布局下测试
+FULL = {
+    "apply": [(p, c, layout) for p in (1, 50, 500) for c in (0, 500, 5000) for layout in ("expanded", "compact") if layout == "compact" or p * c <= 50 * 5000],
+    "china_update": [10000, 50000, 100000],
+}
+QUICK = {
+    "apply": [(p, c, layout) for p in (1, 50) for c in (0, 500) for layout in ("expanded", "compact")],
+    "china_update": [10000],
+}
+
+def make_stubs(bin_dir: str) -> None:
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in STUBS:
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(STUB)
+        os.chmod(path, 0o755)
+
+USER_RULES = """*filter
+:ufw-user-input - [0:0]
+### RULES ###
+
+### END RULES ###
+COMMIT
+"""
+
+def make_ufw_dir(ufw_dir: str) -> None:
+    os.makedirs(ufw_dir, exist_ok=True)
+    for name in ("user.rules", "user6.rules"):
+        with open(os.path.join(ufw_dir, name), "w") as f:
+            f.write(USER_RULES)
+
+def random_cidrs(n: int, rng: random.Random, prefix: int = 24) -> list:
+    # 只取偶数编号的网段，保证聚合后条数不变
+    step = 1 << (32 - prefix)
+    picks = rng.sample(range(0, (1 << prefix) // 2), n)
+    return [f"{(i * 2 * step) >> 24 & 255}.{(i * 2 * step) >> 16 & 255}.{(i * 2 * step) >> 8 & 255}.{i * 2 * step & 255}/{prefix}" for i in picks]
+
+def make_config(ports: int, cidrs: int, layout: str, china_url: str, rng: random.Random) -> dict:
+    policies = ["block_china", "block_non_china", "none"]
+    per_port = cidrs // max(ports, 1) // 4
+    cfg = {
+        "ports": [],
+        "china_ip_source": china_url,
+        "allow_private": True,
+        "whitelist_cidrs": random_cidrs(cidrs // 4, rng),
+        "blacklist_cidrs": random_cidrs(cidrs // 4, rng),
+        "prerouting_priority": -350,
+        "rule_layout": layout,
+    }
+    for i in range(ports):
+        cfg["ports"].append({
+            "port": 10000 + i,
+            "protos": ["tcp", "udp"],
+            "open": True,
+            "china_policy": policies[i % 3],
+            "whitelist_cidrs": random_cidrs(per_port, rng),
+            "blacklist_cidrs": random_cidrs(per_port, rng),
+            "container": "",
+        })
+    return cfg
+
+# 规则求值模型：不依赖内核，按 ruleset.build() 生成的顺序逐条匹配报文，统计每个报文平均
+# 求值的规则条数与集合查找次数；每条连接首包为新连接，其余为已建立连接
+EVAL = {
+    "layouts": ("expanded", "compact"),
+    "ports": (1, 50),
+    "cidrs": 500,
+    "china": 5000,
+    "flows": 500,
+    "packets_per_flow": (1, 100, 10000),
+}
+EXPANDED_RE = re.compile(r"^(tcp|udp) dport (\d+) ip saddr (!= )?(\S+) counter (accept|drop)$")
+COMPACT_RE = re.compile(r"^ip saddr (!= )?@(\S+) meta l4proto \. th dport @(\S+) counter (accept|drop)$")
+CONCAT_RE = re.compile(r"^ip saddr \. meta l4proto \. th dport @(\S+) counter (accept|drop)$")
+
+def compile_rules(ir: dict, china: list) -> list:
+    # 返回 [(match(pkt, stats) -> bool, verdict)]，match 在 stats 中累加集合查找次数
+    from .classify import IntervalIndex
+    from .nft import SET_NAME
+    from .ruleset import FASTPATH_RULE
+    cidr_sets = {SET_NAME: IntervalIndex(china)}
+    key_sets = {}
+    concat_sets = {}
+    for name, spec in ir["sets"].items():
+        if spec["type"] == "ipv4_addr":
+            cidr_sets[name] = IntervalIndex(spec["elements"])
+        elif spec["type"] == "inet_proto . inet_service":
+            key_sets[name] = {tuple(e.split(" . ")) for e in spec["elements"]}
+        else:
+            by_key = {}
+            for e in spec["elements"]:
+                cidr, proto, port = e.split(" . ")
+                by_key.setdefault((proto, port), []).append(cidr)
+            concat_sets[name] = {k: IntervalIndex(v) for k, v in by_key.items()}
+
+    def lookup(stats, name, ip):
+        stats["lookups"] += 1
+        return cidr_sets[name].contains(ip)
+
+    compiled = []
+    for rule in ir["rules"]:
+        if rule == FASTPATH_RULE:
+            compiled.append((lambda pkt, stats: pkt["established"], "accept"))
+        elif m := EXPANDED_RE.match(rule):
+            proto, port, neg, addr, verdict = m.groups()
+            if addr.startswith("@"):
+                name = addr[1:]
+                match = lambda pkt, stats, proto=proto, port=int(port), neg=bool(neg), name=name: (
+                    pkt["proto"] == proto and pkt["port"] == port and lookup(stats, name, pkt["ip"]) != neg)
+            else:
+                net = ipaddress.IPv4Network(addr)
+                match = lambda pkt, stats, proto=proto, port=int(port), lo=int(net.network_address), hi=int(net.broadcast_address): (
+                    pkt["proto"] == proto and pkt["port"] == port and lo <= pkt["ip"] <= hi)
+            compiled.append((match, verdict))
+        elif m := COMPACT_RE.match(rule):
+            neg, name, ports, verdict = m.groups()
+            def match(pkt, stats, neg=bool(neg), name=name, ports=ports):
+                if lookup(stats, name, pkt["ip"]) == neg:
+                    return False
+                stats["lookups"] += 1
+                return (pkt["proto"], str(pkt["port"])) in key_sets[ports]
+            compiled.append((match, verdict))
+        elif m := CONCAT_RE.match(rule):
+            name, verdict = m.groups()
+            def match(pkt, stats, name=name):
+                stats["lookups"] += 1
+                idx = concat_sets[name].get((pkt["proto"], str(pkt["port"])))
+                return idx is not None and idx.contains(pkt["ip"])
+            compiled.append((match, verdict))
+        else:
+            compiled.append((lambda pkt, stats: False, ""))
+    return compiled
+
+def evaluate(compiled: list, pkt: dict) -> dict:
+    stats = {"rules": 0, "lookups": 0}
+    for match, verdict in compiled:
+        stats["rules"] += 1
+        if match(pkt, stats) and verdict:
+            break
+    return stats
+
+def eval_case(cfg: dict, china: list, flows: list, packets_per_flow: int) -> dict:
+    from .classify import ip_to_int
+    from .ruleset import build
+    compiled = compile_rules(build(cfg, len(china)), china)
+    rules = lookups = 0
+    for ip, proto, port in flows:
+        pkt = {"ip": ip_to_int(ip), "proto": proto, "port": port, "established": False}
+        first = evaluate(compiled, pkt)
+        pkt["established"] = True
+        rest = evaluate(compiled, pkt)
+        rules += first["rules"] + rest["rules"] * (packets_per_flow - 1)
+        lookups += first["lookups"] + rest["lookups"] * (packets_per_flow - 1)
+    packets = len(flows) * packets_per_flow
+    return {"rules_per_pkt": round(rules / packets, 2), "lookups_per_pkt": round(lookups / packets, 2)}
+
+def run_eval(seed: int) -> list:
+    rng = random.Random(seed)
+    china = random_cidrs(EVAL["china"], rng)
+    results = []
+    for ports in EVAL["ports"]:
+        for layout in EVAL["layouts"]:
+            cfg = make_config(ports, EVAL["cidrs"], layout, "", rng)
+            # 一半来源取自 china 集合，端口按访问量倾斜到第一个端口（高吞吐代理端口）
+            flows = []
+            for _ in range(EVAL["flows"]):
+                if rng.random() < 0.5:
+                    base = china[rng.randrange(len(china))].split("/")[0].rsplit(".", 1)[0]
+                    ip = f"{base}.{rng.randrange(1, 255)}"
+                else:
+                    ip = ".".join(str(rng.randrange(1, 224)) for _ in range(4))
+                port = 10000 if rng.random() < 0.8 else 10000 + rng.randrange(ports)
+                flows.append((ip, rng.choice(("tcp", "udp")), port))
+            for k in EVAL["packets_per_flow"]:
+                row = {"name": f"p{ports}-{layout}-k{k}"}
+                for fast in (False, True):
+                    cfg["conntrack_fastpath"] = fast
+                    res = eval_case(cfg, china, flows, k)
+                    row["fastpath" if fast else "baseline"] = res
+                results.append(row)
+    return results
+
+def eval_report(results: list) -> str:
+    lines = [f"{'scenario':<24} {'rules/pkt':>10} {'fast':>8} {'lookups/pkt':>12} {'fast':>8}"]
+    for r in results:
+        b, f = r["baseline"], r["fastpath"]
+        lines.append(f"{r['name']:<24} {b['rules_per_pkt']:>10} {f['rules_per_pkt']:>8} {b['lookups_per_pkt']:>12} {f['lookups_per_pkt']:>8}")
+    return "\n".join(lines)
+
+def run_scenario(command: str) -> dict:
+    # 在独立子进程中执行，保证峰值内存与模块导入互不影响
+    from .cli import CnWallCLI
+    start = time.perf_counter()
+    out = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        getattr(CnWallCLI(), f"do_{command}")("")
+    finally:
+        sys.stdout.close()
+        sys.stdout = out
+    wall = time.perf_counter() - start
+    return {"wall": wall, "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def scenario(workdir: str, name: str, command: str, cfg: dict) -> dict:
+    import yaml
+    case_dir = os.path.join(workdir, name)
+    os.makedirs(case_dir, exist_ok=True)
+    cfg_path = os.path.join(case_dir, "config.yaml")
+    with open(cfg_path, "w") as f:
+        yaml.safe_dump(cfg, f, sort_keys=False)
+    log = os.path.join(case_dir, "calls.log")
+    env = dict(os.environ)
+    env.update({
+        "PATH": os.path.join(workdir, "bin") + os.pathsep + env.get("PATH", ""),
+        "CNWALL_CONFIG": cfg_path,
+        "CNWALL_STATE_DIR": os.path.join(case_dir, "state"),
+        "CNWALL_BENCH_LOG": log,
+        "CNWALL_UFW_DIR": os.path.join(case_dir, "ufw"),
+    })
+    make_ufw_dir(os.path.join(case_dir, "ufw"))
+    pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    r = subprocess.run([sys.executable, "-m", "firewall.bench", "--run", command], env=env, cwd=pkg_root, capture_output=True, text=True)
+    if r.returncode != 0:
+        raise RuntimeError(f"{name}: {r.stderr.strip()}")
+    res = json.loads(r.stdout.strip().splitlines()[-1])
+    forks = {}
+    if os.path.exists(log):
+        with open(log) as f:
+            for line in f:
+                tool = line.split(" ", 1)[0]
+                forks[tool] = forks.get(tool, 0) + 1
+    return {"name": name, "wall_ms": round(res["wall"] * 1000, 1), "forks": sum(forks.values()), "forks_by_tool": forks, "peak_mb": round(res["maxrss_kb"] / 1024, 1)}
+
+def run_matrix(matrix: dict, seed: int) -> list:
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="cnwall-bench-")
+    results = []
+    try:
+        make_stubs(os.path.join(workdir, "bin"))
+        china_path = os.path.join(workdir, "china.txt")
+        with open(china_path, "w") as f:
+            f.write("\n".join(random_cidrs(1000, rng)) + "\n")
+        for ports, cidrs, layout in matrix["apply"]:
+            cfg = make_config(ports, cidrs, layout, "file://" + china_path, rng)
+            results.append(scenario(workdir, f"apply-p{ports}-c{cidrs}-{layout}", "apply", cfg))
+        for n in matrix["china_update"]:
+            path = os.path.join(workdir, f"china-{n}.txt")
+            with open(path, "w") as f:
+                f.write("\n".join(random_cidrs(n, rng)) + "\n")
+            cfg = make_config(1, 0, "expanded", "file://" + path, rng)
+            results.append(scenario(workdir, f"china_update-{n}", "china_update", cfg))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def report(results: list, baseline: dict | None) -> str:
+    lines = [f"{'scenario':<36} {'wall_ms':>10} {'forks':>7} {'peak_mb':>8}"]
+    for r in results:
+        line = f"{r['name']:<36} {r['wall_ms']:>10} {r['forks']:>7} {r['peak_mb']:>8}"
+        b = (baseline or {}).get(r["name"])
+        if b:
+            line += f"   基线 {b['wall_ms']}ms/{b['forks']}次 ({r['wall_ms'] / max(b['wall_ms'], 0.001):.2f}x)"
+        lines.append(line)
+    return "\n".join(lines)
+
+def main():
+    p = argparse.ArgumentParser(description="cnwall apply/china_update 基准测试（使用桩 nft/ipset/ufw/docker，无需 root）")
+    p.add_argument("--quick", action="store_true", help="只运行小规模场景")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--save", help="把结果保存为 JSON，可作为后续对比的基线")
+    p.add_argument("--baseline", help="与之前保存的 JSON 结果对比")
+    p.add_argument("--eval", action="store_true", help="按规则求值模型比较 conntrack_fastpath 开启前后每个报文求值的规则数与集合查找次数")
+    p.add_argument("--run", help=argparse.SUPPRESS)
+    args = p.parse_args()
+    if args.run:
+        print(json.dumps(run_scenario(args.run)))
+        return
+    if args.eval:
+        results = run_eval(args.seed)
+        print(eval_report(results))
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2)
+        return
+    results = run_matrix(QUICK if args.quick else FULL, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["name"]: r for r in json.load(f)}
+    print(report(results, baseline))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
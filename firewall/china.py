@@ -0,0 +1,90 @@
+import os
+from .cidr import merge as merge_cidrs, summary as cidr_summary
+from .config import STATE_DIR
+from .ipset import restore as ipset_restore, apply_delta as ipset_apply_delta, members as ipset_members
+from .source import fetch as fetch_source
+from .ruleset import chain_priority
+from .nft import ensure_table_chain_set, replace_elements as nft_replace_elements, apply_delta as nft_apply_delta, set_elements as nft_set_elements
+
+SNAPSHOT_PATH = os.path.join(STATE_DIR, "china.snapshot")
+
+def load_snapshot() -> list | None:
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    with open(SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+        return [l.strip() for l in f if l.strip()]
+
+def save_snapshot(cidrs: list) -> None:
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = SNAPSHOT_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(cidrs) + "\n")
+    os.replace(tmp, SNAPSHOT_PATH)
+
+def live_matches(old: list) -> bool:
+    # 逐个元素比较 nft 集合与 ipset 和快照；被手工修改或只加载了一半的集合即使条数相同也不能作为增量基准
+    want = set(old)
+    if set(nft_set_elements()) != want:
+        return False
+    members = ipset_members()
+    return members is None or members == want
+
+def is_current() -> bool:
+    old = load_snapshot()
+    return old is not None and live_matches(old)
+
+def diff(old: list, new: list) -> tuple:
+    o = set(old)
+    n = set(new)
+    return [c for c in new if c not in o], [c for c in old if c not in n]
+
+def full_reload(cidrs: list, priority: int | str = -350) -> list:
+    # 返回失败信息列表，全部成功时为空
+    errors = [ipset_restore(cidrs)]
+    ensure_table_chain_set(priority)
+    errors.append(nft_replace_elements(cidrs))
+    return [e for e in errors if e]
+
+def apply_list(cidrs: list, priority: int | str = -350, max_delta: int = 2000) -> tuple:
+    # 返回 (是否成功, 说明)；失败时不保存快照，下次更新按全量重新加载
+    old = load_snapshot()
+    if old is not None and live_matches(old):
+        added, removed = diff(old, cidrs)
+        if not added and not removed:
+            return True, "无变化"
+        if len(added) + len(removed) <= max_delta:
+            # ipset 增量失败时两边都按全量重新加载，保持一致
+            if nft_apply_delta(added, removed) and not ipset_apply_delta(added, removed):
+                save_snapshot(cidrs)
+                return True, f"增量更新: +{len(added)} -{len(removed)}"
+    errors = full_reload(cidrs, priority)
+    if errors:
+        return False, "全量更新失败: " + "; ".join(errors)
+    save_snapshot(cidrs)
+    return True, "全量更新"
+
+def fetch_lists(cfg: dict) -> tuple:
+    # 返回 (各来源的 CIDR 列表, 是否有来源变化)
+    src = cfg.get("china_ip_source")
+    sources = src if isinstance(src, list) else [src]
+    lists = []
+    changed = False
+    for url in sources:
+        nets, c = fetch_source(url)
+        lists.append(nets)
+        changed = changed or c
+    return lists, changed
+
+def update(cfg: dict, force: bool = False) -> tuple:
+    # 返回 (是否成功, 说明)
+    lists, changed = fetch_lists(cfg)
+    if not changed and not force and is_current():
+        return True, "china ip来源未变化，跳过更新"
+    raw = sum(len(l) for l in lists)
+    cidrs = merge_cidrs(*lists)
+    if not cidrs:
+        return True, "警告: 下载的china ip列表为空，保留现有集合"
+    ok, mode = apply_list(cidrs, chain_priority(cfg), int(cfg.get("china_delta_max", 2000)))
+    if not ok:
+        return False, f"china ip更新失败: {mode}"
+    return True, f"已更新china ip ({mode}): {cidr_summary(raw, len(cidrs))}"
@@ -0,0 +1,58 @@
+import ipaddress
+
+def parse_line(line: str) -> list:
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return []
+    if "|" in line:
+        # APNIC delegated stats: registry|cc|type|start|value|date|status
+        parts = line.split("|")
+        if len(parts) < 5 or parts[1] != "CN" or parts[2] != "ipv4":
+            return []
+        try:
+            first = ipaddress.IPv4Address(parts[3])
+            last = first + int(parts[4]) - 1
+        except ValueError:
+            return []
+        return list(ipaddress.summarize_address_range(first, last))
+    if "/" not in line:
+        return []
+    try:
+        return [ipaddress.IPv4Network(line.split()[0], strict=False)]
+    except ValueError:
+        return []
+
+def parse_lines(lines) -> list:
+    nets = []
+    for line in lines:
+        nets += parse_line(line)
+    return nets
+
+def to_networks(cidrs) -> list:
+    nets = []
+    for c in cidrs:
+        if isinstance(c, ipaddress.IPv4Network):
+            nets.append(c)
+            continue
+        try:
+            nets.append(ipaddress.IPv4Network(str(c).strip(), strict=False))
+        except ValueError:
+            pass
+    return nets
+
+def aggregate(cidrs) -> list:
+    return [str(n) for n in ipaddress.collapse_addresses(to_networks(cidrs))]
+
+def merge(*sources) -> list:
+    nets = []
+    for s in sources:
+        nets += to_networks(s)
+    return [str(n) for n in ipaddress.collapse_addresses(nets)]
+
+def reduction(before: int, after: int) -> float:
+    if before <= 0:
+        return 0.0
+    return 1 - after / before
+
+def summary(before: int, after: int) -> str:
+    return f"原始 {before} 条，聚合后 {after} 条，缩减 {reduction(before, after):.1%}"
@@ -0,0 +1,138 @@
+import bisect
+import ipaddress
+import re
+import socket
+from .china import load_snapshot
+from .cidr import to_networks
+from .ruleset import PRIVATE_CIDRS, normalize_ports
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+IPV4_RE = re.compile(r"(?<![\d.])((?:\d{1,3}\.){3}\d{1,3})(?![\d.])")
+BATCH = 200000
+
+class IntervalIndex:
+    def __init__(self, cidrs):
+        nets = ipaddress.collapse_addresses(to_networks(cidrs))
+        pairs = [(int(n.network_address), int(n.broadcast_address)) for n in nets]
+        self.starts = [a for a, _ in pairs]
+        self.ends = [b for _, b in pairs]
+        if np is not None:
+            self.np_starts = np.array(self.starts, dtype=np.uint32)
+            self.np_ends = np.array(self.ends, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def contains(self, ip: int) -> bool:
+        i = bisect.bisect_right(self.starts, ip) - 1
+        return i >= 0 and ip <= self.ends[i]
+
+    def contains_many(self, ips):
+        if np is None:
+            return [self.contains(ip) for ip in ips]
+        if not self.starts:
+            return np.zeros(len(ips), dtype=bool)
+        idx = np.searchsorted(self.np_starts, ips, side="right") - 1
+        safe = np.clip(idx, 0, None)
+        return (idx >= 0) & (ips <= self.np_ends[safe])
+
+class Classifier:
+    # 与 apply 生成的规则顺序一致：白名单放行 -> 黑名单丢弃 -> china_policy
+    def __init__(self, cfg: dict, china: list | None = None):
+        china = load_snapshot() if china is None else china
+        self.china = IntervalIndex(china or [])
+        glob_white = list(PRIVATE_CIDRS) if bool(cfg.get("allow_private", True)) else []
+        glob_white += cfg.get("whitelist_cidrs", []) or []
+        glob_black = cfg.get("blacklist_cidrs", []) or []
+        self.ports = {}
+        for p in normalize_ports(cfg):
+            policy = p["china_policy"]
+            if policy == "block_non_china" and not len(self.china):
+                policy = "none"
+            self.ports[p["port"]] = {
+                "white": IntervalIndex(glob_white + p["whitelist_cidrs"]),
+                "black": IntervalIndex(glob_black + p["blacklist_cidrs"]),
+                "policy": policy,
+            }
+
+    def classify(self, ip: int, port: int) -> tuple:
+        p = self.ports.get(port)
+        if p is None:
+            return "accept", "unprotected"
+        if p["white"].contains(ip):
+            return "accept", "whitelist"
+        if p["black"].contains(ip):
+            return "drop", "blacklist"
+        in_china = self.china.contains(ip)
+        if p["policy"] == "block_china" and in_china:
+            return "drop", "china"
+        if p["policy"] == "block_non_china" and not in_china:
+            return "drop", "non_china"
+        return "accept", "pass"
+
+    def classify_many(self, ips, port: int) -> dict:
+        # 返回 {(verdict, reason): 数量}
+        p = self.ports.get(port)
+        n = len(ips)
+        if p is None:
+            return {("accept", "unprotected"): n} if n else {}
+        if np is None:
+            counts = {}
+            for ip in ips:
+                k = self.classify(ip, port)
+                counts[k] = counts.get(k, 0) + 1
+            return counts
+        white = p["white"].contains_many(ips)
+        black = p["black"].contains_many(ips) & ~white
+        rest = ~white & ~black
+        china = self.china.contains_many(ips)
+        if p["policy"] == "block_china":
+            geo = rest & china
+        elif p["policy"] == "block_non_china":
+            geo = rest & ~china
+        else:
+            geo = np.zeros(n, dtype=bool)
+        reason = {"block_china": "china", "block_non_china": "non_china"}.get(p["policy"], "")
+        counts = {
+            ("accept", "whitelist"): int(white.sum()),
+            ("drop", "blacklist"): int(black.sum()),
+            ("drop", reason): int(geo.sum()),
+            ("accept", "pass"): int((rest & ~geo).sum()),
+        }
+        return {k: v for k, v in counts.items() if v}
+
+def ip_to_int(ip: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip), "big")
+
+def to_array(ints: list):
+    return np.array(ints, dtype=np.uint32) if np is not None else ints
+
+def iter_batches(lines, size: int = BATCH):
+    batch = []
+    for line in lines:
+        m = IPV4_RE.search(line)
+        if not m:
+            continue
+        try:
+            batch.append(ip_to_int(m.group(1)))
+        except OSError:
+            continue
+        if len(batch) >= size:
+            yield to_array(batch)
+            batch = []
+    if batch:
+        yield to_array(batch)
+
+def classify_stream(clf: Classifier, lines, ports: list) -> tuple:
+    totals = {port: {} for port in ports}
+    seen = 0
+    for ips in iter_batches(lines):
+        seen += len(ips)
+        for port in ports:
+            for k, v in clf.classify_many(ips, port).items():
+                totals[port][k] = totals[port].get(k, 0) + v
+    return seen, totals
@@ -1,25 +1,44 @@
 import cmd
-from .config import load_config, save_config, DEFAULT_CONFIG_PATH
-from .ufw import status as ufw_status, allow_port, deny_port, allow_docker
-from .nft import ensure_table_chain_set, flush_set as nft_flush, add_elements as nft_add_elements, add_block_rule, add_block_non_china_rule, add_accept_rule, add_drop_cidr_rule, list_ours as nft_list, count_set_elements, flush_policy_chains, delete_table
-from .ipset import ensure_set as ipset_ensure, flush_set as ipset_flush, add_network as ipset_add, list_set as ipset_list
-from .docker_ports import list_published
-from .system import run_cmd
-from .scheduler import set_cron, remove_cron
-import urllib.request
+import sys
+from .config import load_config, save_config
+from .system import trace_begin, trace_end
 
+# 各后端模块在命令内部按需导入，一次性命令与定时任务只加载自身需要的模块
 class CnWallCLI(cmd.Cmd):
     prompt = "cnwall> "
 
+    def precmd(self, line):
+        if line.strip() and line != "EOF":
+            trace_begin(line.split()[0])
+        return line
+
+    def postcmd(self, stop, line):
+        for msg in trace_end():
+            print(msg, file=sys.stderr)
+        return stop
+
     def do_status(self, arg):
+        from concurrent.futures import ThreadPoolExecutor
+        from .docker_ports import list_published
+        from .ipset import list_set as ipset_list
+        from .nft import list_ours as nft_list
+        from .ufw import status as ufw_status
+        jobs = {"ufw": ufw_status, "nftables": nft_list, "ipset": ipset_list, "docker": list_published}
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            futures = {k: pool.submit(f) for k, f in jobs.items()}
+            result = {k: f.result() for k, f in futures.items()}
+        if "--json" in arg.split():
+            import json
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+            return
         print("ufw状态:")
-        print(ufw_status())
+        print(result["ufw"])
         print("nftables状态:")
-        print(nft_list())
+        print(result["nftables"])
         print("ipset状态:")
-        print(ipset_list())
+        print(result["ipset"])
         print("docker端口:")
-        print(list_published())
+        print(result["docker"])
 
     def do_config_show(self, arg):
         cfg = load_config()
@@ -29,85 +48,225 @@ class CnWallCLI(cmd.Cmd):
         save_config({"ports": [], "china_ip_source": "https://raw.githubusercontent.com/gaoyifan/china-operator-ip/ip-lists/china.txt", "schedule_cron": "0 3 * * *", "allow_private": True, "whitelist_cidrs": [], "blacklist_cidrs": [], "prerouting_priority": -350})
         print("已重置配置")
 
+    def do_plan(self, arg):
+        from .plan import compute as compute_plan, describe as describe_plan, is_empty as is_empty_plan
+        cfg = load_config()
+        plan = compute_plan(cfg)
+        for port in plan["skipped"]:
+            print(f"警告: nft集合为空，已跳过端口 {port} 的非中国IP拦截规则")
+        if is_empty_plan(plan):
+            print("无变化")
+            return
+        print("\n".join(describe_plan(plan)))
+
     def do_apply(self, arg):
+        from .plan import compute as compute_plan, execute as execute_plan, is_empty as is_empty_plan
         cfg = load_config()
-        ensure_table_chain_set(cfg.get("prerouting_priority", -350))
-        flush_policy_chains()
-        for p in cfg.get("ports", []):
-            port = int(p.get("port"))
-            protos = p.get("protos")
-            if not protos:
-                proto_single = p.get("proto")
-                if proto_single:
-                    protos = [proto_single]
-                else:
-                    protos = ["tcp"]
-            open_ = bool(p.get("open", True))
-            policy = p.get("china_policy", "none")
-            if policy == True:
-                policy = "block_china"
-            container = p.get("container", "")
-            if open_:
-                for proto in protos:
-                    if container:
-                        print(allow_docker(container, port, proto))
-                    else:
-                        print(allow_port(port, proto))
-            allow_private = bool(cfg.get("allow_private", True))
-            whitelist = []
-            if allow_private:
-                whitelist += ["127.0.0.0/8", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
-            whitelist += cfg.get("whitelist_cidrs", [])
-            whitelist += p.get("whitelist_cidrs", [])
-            for proto in protos:
-                for cidr in whitelist:
-                    add_accept_rule(port, proto, cidr)
-            blacklist = []
-            blacklist += cfg.get("blacklist_cidrs", [])
-            blacklist += p.get("blacklist_cidrs", [])
-            for proto in protos:
-                for cidr in blacklist:
-                    add_drop_cidr_rule(port, proto, cidr)
-            if policy == "block_china":
-                for proto in protos:
-                    add_block_rule(port, proto)
-            elif policy == "block_non_china":
-                if count_set_elements() > 0:
-                    for proto in protos:
-                        add_block_non_china_rule(port, proto)
-                else:
-                    print("警告: nft集合为空，已跳过非中国IP拦截规则")
+        plan = compute_plan(cfg)
+        for port in plan["skipped"]:
+            print(f"警告: nft集合为空，已跳过端口 {port} 的非中国IP拦截规则")
+        if is_empty_plan(plan):
+            print("配置无变化，跳过应用")
+            return
+        ok, out = execute_plan(cfg, plan)
+        for line in out:
+            print(line)
+        if not ok:
+            print("应用失败")
+            return
         print("已应用配置")
 
     def do_reset(self, arg):
+        from .nft import delete_table
         delete_table()
         print("已删除nft表 inet cnwall")
 
     def do_china_update(self, arg):
+        from .china import update as china_update
+        ok, msg = china_update(load_config(), force=arg.strip() == "force")
+        print(msg)
+        if not ok:
+            raise SystemExit(1)
+
+    def do_daemon(self, arg):
+        from .daemon import Daemon
+        try:
+            Daemon().run()
+        except KeyboardInterrupt:
+            pass
+
+    def do_metrics(self, arg):
+        from .metrics import scrape_once
+        print(scrape_once(load_config()), end="")
+
+    def do_metrics_serve(self, arg):
+        from .metrics import serve
+        cfg = load_config()
+        try:
+            serve(arg.strip() or cfg.get("metrics_listen", "127.0.0.1:9465"))
+        except KeyboardInterrupt:
+            pass
+
+    def do_fleet_build(self, arg):
+        from .fleet import build, save
+        art = build(load_config())
+        path = save(art)
+        print(f"制品版本 {art['version']}: china ip {len(art['china'])} 条，规则脚本 {len(art['script'].splitlines())} 行")
+        print(path)
+
+    def do_fleet_apply(self, arg):
+        from .fleet import build, load, push, save, summary
+        parts = arg.split()
         cfg = load_config()
-        src = cfg.get("china_ip_source")
-        ipset_ensure()
-        ipset_flush()
-        ensure_table_chain_set(cfg.get("prerouting_priority", -350))
-        nft_flush()
-        data = urllib.request.urlopen(src, timeout=30).read().decode("utf-8")
-        cidrs = [l.strip() for l in data.splitlines() if l.strip() and "/" in l]
-        for c in cidrs:
-            ipset_add(c)
-        nft_add_elements(cidrs)
-        print("已更新china ip")
+        if len(parts) >= 2 and parts[0] == "--artifact":
+            try:
+                art = load(parts[1])
+            except ValueError as e:
+                print(e)
+                raise SystemExit(1)
+            except OSError as e:
+                print(f"无法读取制品 {parts[1]}: {e.strerror}")
+                raise SystemExit(1)
+            parts = parts[2:]
+        else:
+            art = build(cfg)
+            save(art)
+        opts = cfg.get("fleet", {}) or {}
+        print(f"推送制品 {art['version']} ({opts.get('transport', 'ssh')}, 并发 {opts.get('parallelism', 8)})")
+        results = push(art, opts, parts or None)
+        if not results:
+            print("fleet.hosts 为空，没有可推送的主机")
+            return
+        for line in summary(results):
+            print(line)
+
+    def do_artifact_apply(self, arg):
+        from .fleet import apply, load
+        try:
+            art = load(arg.strip() or "-")
+        except ValueError as e:
+            print(e)
+            raise SystemExit(1)
+        except OSError as e:
+            print(f"无法读取制品 {arg.strip()}: {e.strerror}")
+            raise SystemExit(1)
+        print(f"制品版本 {art['version']}")
+        ok, out = apply(art)
+        for line in out:
+            print(line)
+        if not ok:
+            raise SystemExit(1)
+
+    def do_bans(self, arg):
+        from .ruleset import BAN_SET
+        from .state import load as load_state
+        s = load_state(refresh=True).sets.get(BAN_SET)
+        bans = []
+        for key in (s.elements if s else []):
+            ip, proto, port = key.split(" . ")
+            meta = s.extra.get(key, {})
+            bans.append({"ip": ip.removesuffix("/32"), "port": int(port), "proto": proto, "timeout": meta.get("timeout"), "expires": meta.get("expires")})
+        bans.sort(key=lambda b: (b["port"], b["ip"]))
+        if "--json" in arg.split():
+            import json
+            print(json.dumps(bans, ensure_ascii=False, indent=2))
+            return
+        if not bans:
+            print("当前没有被封禁的IP")
+            return
+        for b in bans:
+            print(f"{b['ip']:<16} {b['port']}/{b['proto']:<4} 剩余 {b['expires']}s / 封禁 {b['timeout']}s")
+        print(f"共 {len(bans)} 条封禁")
+
+    def do_lookup(self, arg):
+        import ipaddress
+        from .classify import Classifier, ip_to_int
+        parts = arg.split()
+        port = None
+        try:
+            addr = ipaddress.ip_address(parts[0]) if parts else None
+            port = int(parts[1]) if len(parts) > 1 else None
+        except ValueError:
+            addr = None
+        if addr is None or (port is not None and not 0 < port < 65536):
+            print("用法: lookup <ip> [port]")
+            return
+        if addr.version != 4:
+            print("仅支持 IPv4 地址")
+            return
+        cfg = load_config()
+        clf = Classifier(cfg)
+        ip = ip_to_int(str(addr))
+        ports = [port] if port is not None else sorted(clf.ports)
+        print(f"{parts[0]} {'属于' if clf.china.contains(ip) else '不属于'}china ip集合")
+        for port in ports:
+            verdict, reason = clf.classify(ip, port)
+            print(f"端口 {port}: {verdict} ({reason})")
+
+    def do_classify(self, arg):
+        from .classify import Classifier, classify_stream
+        parts = arg.split()
+        port = None
+        try:
+            port = int(parts[1]) if len(parts) > 1 else None
+        except ValueError:
+            parts = []
+        if not parts or (port is not None and not 0 < port < 65536):
+            print("用法: classify <日志文件|-> [port]")
+            return
+        cfg = load_config()
+        clf = Classifier(cfg)
+        ports = [port] if port is not None else sorted(clf.ports)
+        if parts[0] == "-":
+            seen, totals = classify_stream(clf, sys.stdin, ports)
+        else:
+            try:
+                with open(parts[0], "r", encoding="utf-8", errors="replace") as f:
+                    seen, totals = classify_stream(clf, f, ports)
+            except OSError as e:
+                print(f"无法读取日志文件 {parts[0]}: {e.strerror}")
+                return
+        print(f"共识别 {seen} 个来源IP")
+        for port in ports:
+            print(f"端口 {port}:")
+            for (verdict, reason), n in sorted(totals[port].items(), key=lambda x: -x[1]):
+                print(f"  {verdict:<6} {reason:<12} {n}")
 
     def do_schedule_set(self, arg):
+        from .scheduler import set_cron
         cfg = load_config()
         cron = cfg.get("schedule_cron", "0 3 * * *")
-        import sys
         print(set_cron(sys.executable, cron))
 
     def do_schedule_remove(self, arg):
+        from .scheduler import remove_cron
         print(remove_cron())
 
+    def do_docker_watch(self, arg):
+        from .docker_ports import watch as watch_docker
+        from .ruleset import normalize_ports
+        from .ufw import batch_allow, pending
+        def on_change(name, old, new):
+            # 与守护进程一致：只为缺失或容器 IP 已变化的端口更新放行，批量写入后只 reload 一次
+            cfg = load_config()
+            rules = []
+            for p in normalize_ports(cfg):
+                if p["container"] == name and p["open"]:
+                    rules += [(p["port"], proto, name) for proto in p["protos"] if (p["port"], proto) in new]
+            for line in batch_allow(pending(rules)):
+                print(line)
+            print(f"容器 {name} 端口变化: {sorted(old)} -> {sorted(new)}")
+        try:
+            watch_docker(on_change)
+        except KeyboardInterrupt:
+            pass
+
     def do_exit(self, arg):
         return True
 
+    def do_EOF(self, arg):
+        print()
+        return True
+
 def run():
     CnWallCLI().cmdloop()
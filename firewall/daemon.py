@@ -0,0 +1,152 @@
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import signal
+import struct
+import threading
+import time
+from .china import update as china_update
+from .config import load_config, DEFAULT_CONFIG_PATH
+from .docker_ports import watch as watch_docker
+from .plan import compute as compute_plan, describe as describe_plan, execute as execute_plan, is_empty as is_empty_plan
+from .ruleset import normalize_ports
+from .state import invalidate as invalidate_state
+from .ufw import batch_allow, pending
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def inotify_watch(path: str, stop: threading.Event, on_change) -> None:
+    # 监听配置文件所在目录，兼容编辑器"写临时文件再 rename"的保存方式；inotify 不可用时回退为 mtime 轮询
+    directory, name = os.path.split(os.path.abspath(path))
+    libc_name = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+    fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK) if libc and hasattr(libc, "inotify_init1") else -1
+    if fd < 0 or libc.inotify_add_watch(fd, directory.encode(), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        if fd >= 0:
+            os.close(fd)
+        poll_watch(path, stop, on_change)
+        return
+    try:
+        while not stop.is_set():
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                continue
+            try:
+                buf = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            hit = False
+            i = 0
+            while i + 16 <= len(buf):
+                _, _, _, length = struct.unpack_from("iIII", buf, i)
+                ev_name = buf[i + 16 : i + 16 + length].rstrip(b"\0").decode(errors="replace")
+                hit = hit or ev_name == name
+                i += 16 + length
+            if hit:
+                on_change()
+    finally:
+        os.close(fd)
+
+def poll_watch(path: str, stop: threading.Event, on_change, interval: float = 2.0) -> None:
+    last = os.path.getmtime(path) if os.path.exists(path) else 0
+    while not stop.wait(interval):
+        cur = os.path.getmtime(path) if os.path.exists(path) else 0
+        if cur != last:
+            last = cur
+            on_change()
+
+class Daemon:
+    def __init__(self, config_path: str = DEFAULT_CONFIG_PATH):
+        self.config_path = config_path
+        self.events = queue.Queue()
+        self.stop = threading.Event()
+
+    def log(self, msg: str) -> None:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+    def open_ports(self, cfg: dict, container: str) -> None:
+        # 容器重启后 IP 可能变化，只为缺失或 IP 已变化的端口更新 ufw-docker 放行
+        rules = []
+        for p in normalize_ports(cfg):
+            if p["open"] and p["container"] == container:
+                rules += [(p["port"], proto, container) for proto in p["protos"]]
+        for line in batch_allow(pending(rules)):
+            self.log(line)
+
+    def reconcile(self, cfg: dict) -> bool:
+        # 对比期望规则与内核实际状态，只应用差异；无差异时不做任何操作
+        invalidate_state()
+        plan = compute_plan(cfg)
+        if is_empty_plan(plan):
+            return False
+        for line in describe_plan(plan):
+            self.log(line)
+        ok, out = execute_plan(cfg, plan)
+        if not ok:
+            self.log(f"应用失败: {' '.join(x.strip() for x in out)}")
+        return ok
+
+    def china_timer(self) -> None:
+        while not self.stop.is_set():
+            interval = int(load_config(self.config_path).get("china_update_interval", 86400))
+            if self.stop.wait(interval):
+                return
+            self.events.put(("china", None))
+
+    def docker_loop(self) -> None:
+        def on_change(name, old, new):
+            self.events.put(("docker", name) if new else ("reconcile", None))
+        while not self.stop.is_set():
+            try:
+                watch_docker(on_change)
+            except Exception as e:
+                self.log(f"docker事件监听中断: {e}")
+            if self.stop.wait(10):
+                return
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda *a: self.stop.set())
+        signal.signal(signal.SIGHUP, lambda *a: self.events.put(("config", None)))
+        for target in (self.china_timer, self.docker_loop):
+            threading.Thread(target=target, daemon=True).start()
+        threading.Thread(target=inotify_watch, args=(self.config_path, self.stop, lambda: self.events.put(("config", None))), daemon=True).start()
+        self.events.put(("china", None))
+        self.events.put(("config", None))
+        self.log("cnwall 守护进程已启动")
+        while not self.stop.is_set():
+            try:
+                kind, arg = self.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            # 合并短时间内的重复事件，例如编辑器保存产生的多次写入
+            pending = {(kind, arg)}
+            time.sleep(0.5)
+            while True:
+                try:
+                    pending.add(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.handle(pending)
+            except Exception as e:
+                self.log(f"处理事件失败: {e}")
+        self.log("cnwall 守护进程已退出")
+
+    def handle(self, pending: set) -> None:
+        cfg = load_config(self.config_path)
+        kinds = {k for k, _ in pending}
+        if "china" in kinds:
+            self.log(china_update(cfg)[1])
+        if "config" in kinds:
+            self.log("配置已变化")
+        for kind, name in pending:
+            if kind == "docker":
+                self.log(f"容器 {name} 已启动")
+                self.open_ports(cfg, container=name)
+        if self.reconcile(cfg):
+            self.log("已应用配置")
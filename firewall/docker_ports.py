@@ -1,22 +1,180 @@
+import http.client
 import json
-from .system import has_cmd, run_cmd
+import os
+import socket
+import urllib.parse
+from .system import has_cmd, run_cmd, popen
 
-def list_published() -> list:
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = 10):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        s.connect(self.socket_path)
+        self.sock = s
+
+_conn: UnixHTTPConnection | None = None
+
+def api_available(socket_path: str = DOCKER_SOCKET) -> bool:
+    return os.path.exists(socket_path) and os.access(socket_path, os.R_OK | os.W_OK)
+
+def api_get(path: str, socket_path: str = DOCKER_SOCKET):
+    # 复用同一条 unix socket 连接；连接被对端关闭时重连一次
+    global _conn
+    for attempt in (0, 1):
+        if _conn is None or _conn.socket_path != socket_path:
+            _conn = UnixHTTPConnection(socket_path)
+        try:
+            _conn.request("GET", path)
+            resp = _conn.getresponse()
+            body = resp.read()
+        except (http.client.HTTPException, OSError):
+            _conn.close()
+            _conn = None
+            if attempt:
+                raise
+            continue
+        if resp.status >= 400:
+            raise OSError(f"docker api {path}: {resp.status} {body[:200]!r}")
+        return json.loads(body)
+
+def ports_from_inspect(data: dict) -> list:
+    ports = []
+    name = data.get("Name", "").strip("/")
+    pb = (data.get("NetworkSettings") or {}).get("Ports") or {}
+    for k, v in pb.items():
+        if v:
+            p, proto = k.split("/")
+            try:
+                ports.append({"container": name, "port": int(p), "proto": proto})
+            except Exception:
+                pass
+    return ports
+
+def ports_from_summary(data: dict) -> list:
+    ports = []
+    names = data.get("Names") or [""]
+    name = names[0].strip("/")
+    seen = set()
+    for p in data.get("Ports") or []:
+        if not p.get("PublicPort"):
+            continue
+        key = (p.get("PrivatePort"), p.get("Type", "tcp"))
+        if key in seen:
+            continue
+        seen.add(key)
+        ports.append({"container": name, "port": int(key[0]), "proto": key[1]})
+    return ports
+
+def list_published(socket_path: str = DOCKER_SOCKET) -> list:
+    if api_available(socket_path):
+        try:
+            ports = []
+            for c in api_get("/containers/json", socket_path):
+                ports += ports_from_summary(c)
+            return ports
+        except (OSError, ValueError):
+            pass
     if not has_cmd("docker"):
         return []
-    r = run_cmd(["docker", "ps", "--format", "{{.ID}}"])
+    r = run_cmd(["docker", "ps", "-q"])
     ids = [x.strip() for x in r.stdout.splitlines() if x.strip()]
+    if not ids:
+        return []
+    ins = run_cmd(["docker", "inspect"] + ids)
+    try:
+        data = json.loads(ins.stdout or "[]")
+    except ValueError:
+        return []
     ports = []
-    for cid in ids:
-        ins = run_cmd(["docker", "inspect", cid]).stdout
-        data = json.loads(ins)[0]
-        pb = data.get("NetworkSettings", {}).get("Ports", {})
-        for k, v in pb.items():
-            if v:
-                p, proto = k.split("/")
-                try:
-                    ports.append({"container": data.get("Name", "").strip("/"), "port": int(p), "proto": proto})
-                except Exception:
-                    pass
+    for d in data:
+        ports += ports_from_inspect(d)
     return ports
 
+def container_ports(cid: str, socket_path: str = DOCKER_SOCKET) -> list:
+    if api_available(socket_path):
+        try:
+            return ports_from_inspect(api_get(f"/containers/{urllib.parse.quote(cid)}/json", socket_path))
+        except (OSError, ValueError):
+            pass
+    if not has_cmd("docker"):
+        return []
+    r = run_cmd(["docker", "inspect", cid])
+    try:
+        return ports_from_inspect(json.loads(r.stdout)[0])
+    except (ValueError, IndexError):
+        return []
+
+def container_ips(name: str, socket_path: str = DOCKER_SOCKET) -> list:
+    data = None
+    if api_available(socket_path):
+        try:
+            data = api_get(f"/containers/{urllib.parse.quote(name)}/json", socket_path)
+        except (OSError, ValueError):
+            data = None
+    if data is None and has_cmd("docker"):
+        r = run_cmd(["docker", "inspect", name])
+        try:
+            data = json.loads(r.stdout)[0]
+        except (ValueError, IndexError):
+            data = None
+    if not data:
+        return []
+    networks = (data.get("NetworkSettings") or {}).get("Networks") or {}
+    return [n["IPAddress"] for n in networks.values() if n.get("IPAddress")]
+
+def port_map(ports: list) -> dict:
+    m = {}
+    for p in ports:
+        m.setdefault(p["container"], set()).add((p["port"], p["proto"]))
+    return m
+
+def iter_events(socket_path: str = DOCKER_SOCKET):
+    filters = json.dumps({"type": ["container"], "event": ["start", "die"]})
+    if api_available(socket_path):
+        conn = UnixHTTPConnection(socket_path, timeout=None)
+        conn.request("GET", "/events?filters=" + urllib.parse.quote(filters))
+        resp = conn.getresponse()
+        try:
+            while True:
+                line = resp.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+    elif has_cmd("docker"):
+        proc = popen(["docker", "events", "--format", "{{json .}}", "--filter", "type=container", "--filter", "event=start", "--filter", "event=die"])
+        try:
+            for line in proc.stdout:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            proc.terminate()
+
+def watch(callback, socket_path: str = DOCKER_SOCKET) -> None:
+    # 维护 容器名 -> {(端口, 协议)} 映射，容器启动/停止时回调 callback(name, old, new)
+    live = port_map(list_published(socket_path))
+    for ev in iter_events(socket_path):
+        action = ev.get("Action") or ev.get("status")
+        cid = ev.get("id") or ev.get("ID") or ""
+        name = ((ev.get("Actor") or {}).get("Attributes") or {}).get("name", "")
+        old = live.get(name, set())
+        if action == "start":
+            new = port_map(container_ports(cid, socket_path)).get(name, set())
+        elif action == "die":
+            new = set()
+        else:
+            continue
+        if new:
+            live[name] = new
+        else:
+            live.pop(name, None)
+        if old != new:
+            callback(name, old, new)
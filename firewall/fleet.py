@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .config import STATE_DIR
+from .system import run_cmd
+
+ARTIFACT_FORMAT = 1
+ARTIFACT_DIR = os.path.join(STATE_DIR, "fleet")
+# 参与 sha256 计算的字段；created 等元信息不影响版本号
+PAYLOAD_KEYS = ("format", "config", "china", "script")
+
+def digest(art: dict) -> str:
+    payload = {k: art[k] for k in PAYLOAD_KEYS}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def build(cfg: dict) -> dict:
+    # 在控制端下载并聚合 china 列表、渲染规则脚本，各节点不再各自下载与解析
+    from .china import fetch_lists
+    from .cidr import merge as merge_cidrs
+    from .ruleset import render
+    lists, _ = fetch_lists(cfg)
+    china = merge_cidrs(*lists)
+    script, _ = render(cfg, len(china))
+    art = {"format": ARTIFACT_FORMAT, "config": cfg, "china": china, "script": script}
+    art["sha256"] = digest(art)
+    art["version"] = art["sha256"][:12]
+    art["created"] = int(time.time())
+    return art
+
+def save(art: dict) -> str:
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    path = os.path.join(ARTIFACT_DIR, f"{art['version']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(art, f, ensure_ascii=False)
+    return path
+
+def load(path: str) -> dict:
+    try:
+        if path == "-":
+            art = json.load(sys.stdin)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                art = json.load(f)
+    except ValueError as e:
+        raise ValueError(f"制品不是有效的 JSON: {e}")
+    if not isinstance(art, dict) or art.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"不支持的制品格式: {art.get('format') if isinstance(art, dict) else type(art).__name__}")
+    missing = [k for k in PAYLOAD_KEYS + ("sha256", "version") if k not in art]
+    if missing:
+        raise ValueError(f"制品缺少字段: {', '.join(missing)}")
+    if digest(art) != art.get("sha256"):
+        raise ValueError("制品校验失败: sha256 不匹配")
+    return art
+
+def apply(art: dict) -> tuple:
+    # 节点端：写入制品中的配置与 china 列表，再按本机内核状态计算差异并应用
+    from .china import apply_list
+    from .config import save_config
+    from .plan import compute, execute, is_empty
+    from .ruleset import chain_priority
+    from .state import invalidate as invalidate_state
+    cfg = art["config"]
+    out = []
+    # 保存为本机配置，避免本机守护进程按旧配置把规则改回去
+    save_config(cfg)
+    if art["china"]:
+        ok, msg = apply_list(art["china"], chain_priority(cfg), int(cfg.get("china_delta_max", 2000)))
+        out.append(f"china ip: {msg}")
+        if not ok:
+            return False, out
+    invalidate_state()
+    plan = compute(cfg)
+    if is_empty(plan):
+        out.append("配置无变化，跳过应用")
+        return True, out
+    ok, lines = execute(cfg, plan)
+    out += [line.strip() for line in lines if line.strip()]
+    out.append("已应用配置" if ok else "应用失败")
+    return ok, out
+
+class SSHTransport:
+    def __init__(self, opts: dict):
+        self.ssh = ["ssh", "-o", "BatchMode=yes"] + list(opts.get("ssh_options", []) or [])
+        self.remote_dir = opts.get("remote_dir", "/opt/nodesshell")
+        self.python = opts.get("python", "python3")
+
+    def run(self, host: dict, input: str, timeout: float) -> subprocess.CompletedProcess:
+        # 制品通过标准输入传给节点，推送与应用只需一次 ssh 连接
+        target = f"{host['user']}@{host['host']}" if host.get("user") else host["host"]
+        port = ["-p", str(host["port"])] if host.get("port") else []
+        remote = f"cd {shlex.quote(host.get('remote_dir', self.remote_dir))} && {shlex.quote(host.get('python', self.python))} -m firewall.main artifact_apply -"
+        return run_cmd(self.ssh + port + [target, remote], input=input, timeout=timeout)
+
+class LocalTransport:
+    # 在本机以子进程执行 artifact_apply，每个主机使用独立的状态目录，用于测试与演练
+    def __init__(self, opts: dict):
+        self.root = opts.get("local_root") or os.path.join(ARTIFACT_DIR, "local")
+
+    def run(self, host: dict, input: str, timeout: float) -> subprocess.CompletedProcess:
+        base = os.path.join(self.root, host["host"])
+        os.makedirs(base, exist_ok=True)
+        env = dict(os.environ)
+        env.update({"CNWALL_CONFIG": os.path.join(base, "config.yaml"), "CNWALL_STATE_DIR": os.path.join(base, "state")})
+        env.update(host.get("env", {}) or {})
+        # 子进程的计时记录不写入控制端的 trace 文件
+        env.pop("CNWALL_TRACE", None)
+        pkg_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return run_cmd([sys.executable, "-m", "firewall.main", "artifact_apply", "-"], input=input, timeout=timeout, cwd=pkg_root, env=env)
+
+TRANSPORTS = {"ssh": SSHTransport, "local": LocalTransport}
+
+def inventory(opts: dict) -> list:
+    hosts = []
+    for h in opts.get("hosts", []) or []:
+        if isinstance(h, str):
+            user, _, host = h.rpartition("@")
+            host, _, port = host.partition(":")
+            h = {"host": host, "user": user, "port": int(port) if port else None}
+        hosts.append(h)
+    return hosts
+
+def push_one(transport, host: dict, text: str, timeout: float) -> dict:
+    start = time.perf_counter()
+    try:
+        r = transport.run(host, text, timeout)
+    except subprocess.TimeoutExpired:
+        status, detail = "timeout", f"超过 {timeout}s 未完成"
+    except OSError as e:
+        status, detail = "error", str(e)
+    else:
+        lines = [x for x in (r.stdout + r.stderr).splitlines() if x.strip()]
+        status = "ok" if r.returncode == 0 else "failed"
+        detail = lines[-1] if lines else f"exit {r.returncode}"
+    return {"host": host["host"], "status": status, "seconds": round(time.perf_counter() - start, 2), "detail": detail}
+
+def push(art: dict, opts: dict, only: list | None = None) -> list:
+    hosts = [h for h in inventory(opts) if not only or h["host"] in only]
+    transport = TRANSPORTS[opts.get("transport", "ssh")](opts)
+    timeout = float(opts.get("timeout", 120))
+    text = json.dumps(art, ensure_ascii=False)
+    if not hosts:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(opts.get("parallelism", 8)), len(hosts)))) as pool:
+        return list(pool.map(lambda h: push_one(transport, h, text, timeout), hosts))
+
+def summary(results: list) -> list:
+    lines = [f"{r['host']:<24} {r['status']:<8} {r['seconds']:>7}s  {r['detail']}" for r in results]
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    lines.append(f"共 {len(results)} 台: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+    return lines
@@ -1,3 +1,4 @@
+from .state import norm_addr
 from .system import has_cmd, run_cmd
 
 SET_NAME = "cnwall_china"
@@ -20,6 +21,50 @@ def add_network(cidr: str) -> None:
         return
     run_cmd(["ipset", "add", SET_NAME, cidr])
 
+def restore(cidrs: list) -> str:
+    # 成功时返回空字符串，失败时返回错误信息
+    if not available():
+        return ""
+    tmp = f"{SET_NAME}_new"
+    maxelem = max(65536, len(cidrs))
+    lines = [
+        f"create {SET_NAME} hash:net",
+        f"create {tmp} hash:net maxelem {maxelem}",
+        f"flush {tmp}",
+    ]
+    lines += [f"add {tmp} {c}" for c in cidrs]
+    lines += [f"swap {tmp} {SET_NAME}", f"destroy {tmp}"]
+    r = run_cmd(["ipset", "-exist", "restore"], input="\n".join(lines) + "\n")
+    if r.returncode != 0:
+        run_cmd(["ipset", "destroy", tmp])
+        return f"ipset批量加载失败: {r.stderr.strip()}"
+    return ""
+
+def apply_delta(added: list, removed: list) -> str:
+    if not available():
+        return ""
+    lines = [f"del {SET_NAME} {c}" for c in removed] + [f"add {SET_NAME} {c}" for c in added]
+    if not lines:
+        return ""
+    r = run_cmd(["ipset", "-exist", "restore"], input="\n".join(lines) + "\n")
+    if r.returncode != 0:
+        return f"ipset增量更新失败: {r.stderr.strip()}"
+    return ""
+
+def members() -> set | None:
+    # 返回集合中的网段（/32 统一带前缀长度）；ipset 未安装时返回 None，集合不存在时返回空集合
+    if not available():
+        return None
+    r = run_cmd(["ipset", "save", SET_NAME])
+    if r.returncode != 0:
+        return set()
+    out = set()
+    for line in r.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[:2] == ["add", SET_NAME]:
+            out.add(norm_addr(parts[2]))
+    return out
+
 def list_set() -> str:
     if not available():
         return "ipset未安装"
@@ -1,16 +1,30 @@
 import argparse
+import os
+import sys
 from .cli import run as cli_run, CnWallCLI
+from .system import enable_trace, trace_begin, trace_end
 
 def main():
     p = argparse.ArgumentParser()
+    p.add_argument("--trace", action="store_true", help="记录外部命令的耗时，输出 JSON 记录与最慢调用摘要（也可设置环境变量 CNWALL_TRACE）")
     p.add_argument("command", nargs="?")
+    p.add_argument("args", nargs=argparse.REMAINDER)
     args = p.parse_args()
+    if "--trace" in args.args:
+        args.args.remove("--trace")
+        args.trace = True
+    if args.trace or os.environ.get("CNWALL_TRACE", "0") != "0":
+        enable_trace()
     if not args.command:
         cli_run()
         return
     c = CnWallCLI()
-    getattr(c, f"do_{args.command}")("")
+    trace_begin(args.command)
+    try:
+        getattr(c, f"do_{args.command}")(" ".join(args.args))
+    finally:
+        for msg in trace_end():
+            print(msg, file=sys.stderr)
 
 if __name__ == "__main__":
     main()
-
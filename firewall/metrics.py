@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import STATE_DIR, load_config
+from .nft import SET_NAME
+from .ruleset import BAN_SET, RATE_SET_PREFIX, normalize_ports
+from .state import load as load_state
+
+LAST_SAMPLE_PATH = os.path.join(STATE_DIR, "metrics.json")
+
+# 使用元素计数器的紧凑布局集合 -> 规则类别
+SET_KINDS = {
+    "cnwall_whitelist_port": "whitelist",
+    "cnwall_blacklist_port": "blacklist",
+    "cnwall_ports_block_china": "china",
+    "cnwall_ports_block_non_china": "non_china",
+}
+
+def rule_kind(r) -> str:
+    if r.ct_state and r.verdict == "accept":
+        return "established"
+    if any(s.startswith(RATE_SET_PREFIX) for s in r.sets):
+        return "rate_limit"
+    if BAN_SET in r.sets:
+        return "ban"
+    if r.saddr == f"@{SET_NAME}" or SET_NAME in r.sets:
+        return "non_china" if r.saddr_neg else "china"
+    if r.verdict == "accept":
+        return "whitelist"
+    return "blacklist"
+
+def collect(cfg: dict) -> tuple:
+    # 一次 nft -j 读取整张表，返回按标签汇总的计数样本与各集合元素数
+    policies = {p["port"]: p["china_policy"] for p in normalize_ports(cfg)}
+    table = load_state(refresh=True)
+    totals = {}
+
+    def add(port, proto, kind, verdict, packets, bytes_):
+        policy = policies.get(port, "none") if isinstance(port, int) else "*"
+        key = (str(port), proto or "*", policy, kind, verdict)
+        cur = totals.get(key, (0, 0))
+        totals[key] = (cur[0] + packets, cur[1] + bytes_)
+
+    # 带元素计数器的集合按端口统计，对应规则本身的计数不再重复计入
+    counted = {n for n in SET_KINDS if n in table.sets and table.sets[n].extra}
+    for r in table.rules:
+        if counted.intersection(r.sets):
+            continue
+        add(r.dport if r.dport is not None else "*", r.proto, rule_kind(r), r.verdict, r.packets, r.bytes)
+    for name, kind in SET_KINDS.items():
+        s = table.sets.get(name)
+        if not s:
+            continue
+        verdict = "accept" if kind == "whitelist" else "drop"
+        for key, meta in s.extra.items():
+            c = meta.get("counter")
+            if not c:
+                continue
+            proto, port = key.split(" . ")[-2:]
+            add(int(port) if port.isdigit() else port, proto, kind, verdict, c.get("packets", 0), c.get("bytes", 0))
+    sizes = {name: len(s.elements) for name, s in table.sets.items()}
+    return [{"labels": dict(zip(("port", "proto", "policy", "kind", "verdict"), k)), "packets": v[0], "bytes": v[1]} for k, v in sorted(totals.items())], sizes
+
+def label_str(labels: dict) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels.items())
+
+def rates(samples: list, prev: dict | None, now: float) -> dict:
+    if not prev or now <= prev.get("time", now):
+        return {}
+    dt = now - prev["time"]
+    last = prev.get("packets", {})
+    out = {}
+    for s in samples:
+        if s["labels"]["verdict"] != "drop":
+            continue
+        key = label_str(s["labels"])
+        if key in last and s["packets"] >= last[key]:
+            out[key] = (s["packets"] - last[key]) / dt
+    return out
+
+def render(samples: list, sizes: dict, drop_rates: dict) -> str:
+    lines = [
+        "# HELP cnwall_packets_total Packets matched by cnwall rules.",
+        "# TYPE cnwall_packets_total counter",
+    ]
+    lines += [f"cnwall_packets_total{{{label_str(s['labels'])}}} {s['packets']}" for s in samples]
+    lines += [
+        "# HELP cnwall_bytes_total Bytes matched by cnwall rules.",
+        "# TYPE cnwall_bytes_total counter",
+    ]
+    lines += [f"cnwall_bytes_total{{{label_str(s['labels'])}}} {s['bytes']}" for s in samples]
+    lines += [
+        "# HELP cnwall_drop_rate Dropped packets per second since the previous scrape.",
+        "# TYPE cnwall_drop_rate gauge",
+    ]
+    lines += [f"cnwall_drop_rate{{{k}}} {v:.3f}" for k, v in sorted(drop_rates.items())]
+    lines += [
+        "# HELP cnwall_set_elements Number of elements in each cnwall set.",
+        "# TYPE cnwall_set_elements gauge",
+    ]
+    lines += [f'cnwall_set_elements{{set="{k}"}} {v}' for k, v in sorted(sizes.items())]
+    return "\n".join(lines) + "\n"
+
+def snapshot(samples: list, now: float) -> dict:
+    return {"time": now, "packets": {label_str(s["labels"]): s["packets"] for s in samples}}
+
+def scrape(cfg: dict, prev: dict | None) -> tuple:
+    now = time.time()
+    samples, sizes = collect(cfg)
+    return render(samples, sizes, rates(samples, prev, now)), snapshot(samples, now)
+
+def scrape_once(cfg: dict) -> str:
+    # 命令行模式下把上次采样写到 state 目录，用于计算两次执行之间的丢包速率
+    prev = None
+    if os.path.exists(LAST_SAMPLE_PATH):
+        with open(LAST_SAMPLE_PATH, "r", encoding="utf-8") as f:
+            prev = json.load(f)
+    text, snap = scrape(cfg, prev)
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(LAST_SAMPLE_PATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snap, f)
+    os.replace(LAST_SAMPLE_PATH + ".tmp", LAST_SAMPLE_PATH)
+    return text
+
+def serve(listen: str) -> None:
+    host, _, port = listen.rpartition(":")
+    lock = threading.Lock()
+    last = {"snap": None}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            with lock:
+                text, last["snap"] = scrape(load_config(), last["snap"])
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+    print(f"metrics 监听于 http://{host or '127.0.0.1'}:{port}/metrics")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -1,9 +1,9 @@
 from .system import has_cmd, run_cmd
-
-TABLE = "inet"
-TABLE_NAME = "cnwall"
+from .state import TABLE, TABLE_NAME, load as load_state, invalidate as invalidate_state, norm_addr
 CHAIN_PREROUTING = "filter_prerouting"
+CHAIN_FORWARD = "filter_forward"
 SET_NAME = "cnwall_china"
+FLOWTABLE = "cnwall_ft"
 
 def available() -> bool:
     return has_cmd("nft")
@@ -11,13 +11,21 @@ def available() -> bool:
 def ensure_table_chain_set(priority: int | str = -350) -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "add", "table", TABLE, TABLE_NAME])
     run_cmd(["nft", "add", "chain", TABLE, TABLE_NAME, CHAIN_PREROUTING, "{", "type", "filter", "hook", "prerouting", "priority", str(priority), ";", "policy", "accept", ";", "}"])
     run_cmd(["nft", "add", "set", TABLE, TABLE_NAME, SET_NAME, "{", "type", "ipv4_addr", ";", "flags", "interval", ";", "}"])
 
+def load_script(script: str):
+    if not available():
+        return None
+    invalidate_state()
+    return run_cmd(["nft", "-f", "-"], input=script)
+
 def flush_set() -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "flush", "set", TABLE, TABLE_NAME, SET_NAME])
 
 def add_elements(elements: list) -> None:
@@ -25,33 +33,59 @@ def add_elements(elements: list) -> None:
         return
     if not elements:
         return
+    invalidate_state()
     batch = 200
     for i in range(0, len(elements), batch):
         chunk = elements[i : i + batch]
         joined = ",".join(chunk)
         run_cmd(["nft", "add", "element", TABLE, TABLE_NAME, SET_NAME, "{", joined, "}"])
 
+def replace_elements(elements: list) -> str:
+    # 成功时返回空字符串，失败时返回错误信息
+    if not available():
+        return ""
+    lines = [
+        f"add table {TABLE} {TABLE_NAME}",
+        f"add set {TABLE} {TABLE_NAME} {SET_NAME} {{ type ipv4_addr; flags interval; }}",
+        f"flush set {TABLE} {TABLE_NAME} {SET_NAME}",
+    ]
+    batch = 5000
+    for i in range(0, len(elements), batch):
+        chunk = elements[i : i + batch]
+        lines.append(f"add element {TABLE} {TABLE_NAME} {SET_NAME} {{ {', '.join(chunk)} }}")
+    r = load_script("\n".join(lines) + "\n")
+    if r is not None and r.returncode != 0:
+        return f"nft批量加载失败: {r.stderr.strip()}"
+    return ""
+
+def apply_delta(added: list, removed: list) -> bool:
+    if not available():
+        return True
+    lines = []
+    if removed:
+        lines.append(f"delete element {TABLE} {TABLE_NAME} {SET_NAME} {{ {', '.join(removed)} }}")
+    if added:
+        lines.append(f"add element {TABLE} {TABLE_NAME} {SET_NAME} {{ {', '.join(added)} }}")
+    if not lines:
+        return True
+    r = load_script("\n".join(lines) + "\n")
+    return r.returncode == 0
+
 def add_block_rule(port: int, proto: str = "tcp") -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "add", "rule", TABLE, TABLE_NAME, CHAIN_PREROUTING, proto, "dport", str(port), "ip", "saddr", f"@{SET_NAME}", "counter", "drop"])
 
+def delete_rules(rules: list) -> None:
+    if not available() or not rules:
+        return
+    load_script("".join(f"delete rule {TABLE} {TABLE_NAME} {r.chain} handle {r.handle}\n" for r in rules))
+
 def delete_block_rule(port: int, proto: str = "tcp") -> None:
     if not available():
         return
-    for chain in (CHAIN_PREROUTING,):
-        r = run_cmd(["nft", "list", "chain", TABLE, TABLE_NAME, chain])
-        if r.returncode != 0:
-            continue
-        rules = r.stdout.splitlines()
-        for line in rules:
-            if f"{proto} dport {port}" in line and f"@{SET_NAME}" in line:
-                parts = line.split()
-                if "handle" in parts:
-                    idx = parts.index("handle")
-                    if idx + 1 < len(parts):
-                        handle = parts[idx + 1]
-                        run_cmd(["nft", "delete", "rule", TABLE, TABLE_NAME, chain, "handle", handle])
+    delete_rules(load_state().find_rules(CHAIN_PREROUTING, proto=proto, dport=port, saddr=f"@{SET_NAME}"))
 
 def list_ours() -> str:
     if not available():
@@ -64,54 +98,44 @@ def list_ours() -> str:
 def add_block_non_china_rule(port: int, proto: str = "tcp") -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "add", "rule", TABLE, TABLE_NAME, CHAIN_PREROUTING, proto, "dport", str(port), "ip", "saddr", "!=", f"@{SET_NAME}", "counter", "drop"])
 
 def count_set_elements() -> int:
     if not available():
         return 0
-    r = run_cmd(["nft", "list", "set", TABLE, TABLE_NAME, SET_NAME])
-    if r.returncode != 0:
-        return 0
-    text = r.stdout
-    if "elements = {" not in text:
-        return 0
-    # naive count by commas; suitable for large sets
-    try:
-        body = text.split("elements = {", 1)[1].split("}", 1)[0]
-        return len([x for x in body.split(",") if x.strip()])
-    except Exception:
-        return 0
+    return load_state().set_count(SET_NAME)
+
+def set_elements() -> list:
+    if not available():
+        return []
+    s = load_state().sets.get(SET_NAME)
+    return s.elements if s else []
 
 def add_accept_rule(port: int, proto: str, cidr: str) -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "add", "rule", TABLE, TABLE_NAME, CHAIN_PREROUTING, proto, "dport", str(port), "ip", "saddr", cidr, "counter", "accept"])
 
 def add_drop_cidr_rule(port: int, proto: str, cidr: str) -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "add", "rule", TABLE, TABLE_NAME, CHAIN_PREROUTING, proto, "dport", str(port), "ip", "saddr", cidr, "counter", "drop"])
 
 def delete_accept_rule(port: int, proto: str, cidr: str) -> None:
     if not available():
         return
-    for chain in (CHAIN_PREROUTING,):
-        r = run_cmd(["nft", "list", "chain", TABLE, TABLE_NAME, chain])
-        if r.returncode != 0:
-            continue
-        for line in r.stdout.splitlines():
-            if f"{proto} dport {port}" in line and cidr in line and "accept" in line:
-                parts = line.split()
-                if "handle" in parts:
-                    idx = parts.index("handle")
-                    if idx + 1 < len(parts):
-                        handle = parts[idx + 1]
-                        run_cmd(["nft", "delete", "rule", TABLE, TABLE_NAME, chain, "handle", handle])
+    delete_rules(load_state().find_rules(CHAIN_PREROUTING, proto=proto, dport=port, saddr=norm_addr(cidr), verdict="accept"))
+
 def flush_policy_chains() -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "flush", "chain", TABLE, TABLE_NAME, CHAIN_PREROUTING])
 def delete_table() -> None:
     if not available():
         return
+    invalidate_state()
     run_cmd(["nft", "delete", "table", TABLE, TABLE_NAME])
@@ -0,0 +1,169 @@
+from .nft import TABLE, TABLE_NAME, CHAIN_PREROUTING, CHAIN_FORWARD, SET_NAME, FLOWTABLE, load_script, count_set_elements
+from .ruleset import COMPACT_SETS, build, chain_priority, flowtable_devices, insert_line, is_rate_set, normalize_ports, render, rule_id, rule_line, set_decl
+from .state import load as load_state
+from .ufw import batch_allow, pending
+
+def empty_plan() -> dict:
+    return {
+        "full": "",
+        "rebuild": False,
+        "rules_add": [],
+        "rules_insert": [],
+        "rules_del": [],
+        "sets_add": {},
+        "sets_del": [],
+        "elements_add": {},
+        "elements_del": {},
+        "ufw": [],
+        "skipped": [],
+        "drop_flowtable": False,
+        "recreate_chain": False,
+    }
+
+def desired_ufw(cfg: dict) -> list:
+    # 容器规则按当前容器 IP 比较，容器重建后 IP 变化同样视为需要更新
+    rules = []
+    for p in normalize_ports(cfg):
+        if p["open"]:
+            rules += [(p["port"], proto, p["container"]) for proto in p["protos"]]
+    return pending(rules)
+
+def set_changed(cur, spec: dict) -> bool:
+    # 类型、flags 与 counter 无法在已有集合上修改，只能删除后重建
+    return cur.type != spec["type"] or sorted(cur.flags) != sorted(spec["flags"]) or cur.counter != spec.get("counter", False)
+
+def stale_sets(live, ir: dict) -> list:
+    # 内核中需要删除的集合：不再使用的限速/compact 集合，以及定义已变化的集合
+    return [n for n, cur in live.sets.items()
+            if (n in ir["sets"] and set_changed(cur, ir["sets"][n]))
+            or (n not in ir["sets"] and (is_rate_set(n) or n in COMPACT_SETS))]
+
+def compute(cfg: dict) -> dict:
+    plan = empty_plan()
+    plan["ufw"] = desired_ufw(cfg)
+    ir = build(cfg, count_set_elements())
+    plan["skipped"] = ir["skipped"]
+    live = load_state()
+    chain = live.chains.get(CHAIN_PREROUTING)
+    # 全量应用时同样需要删除，否则 add set 与遗留的同名集合冲突
+    plan["sets_del"] = stale_sets(live, ir)
+    if not live.exists or chain is None or SET_NAME not in live.sets:
+        plan["full"] = live.error or "nft表/链/集合不存在"
+        plan["rules_add"] = ir["rules"]
+        return plan
+    if str(chain.get("prio")) != str(chain_priority(cfg)):
+        plan["full"] = f"链优先级变化: {chain.get('prio')} -> {chain_priority(cfg)}"
+        plan["recreate_chain"] = True
+        plan["drop_flowtable"] = FLOWTABLE in live.flowtables
+        plan["rules_add"] = ir["rules"]
+        return plan
+    ft = live.flowtables.get(FLOWTABLE)
+    devices = flowtable_devices(cfg)
+    live_devices = sorted([ft["dev"]] if isinstance(ft.get("dev"), str) else ft.get("dev", [])) if ft else []
+    if devices != live_devices or bool(devices) != (CHAIN_FORWARD in live.chains):
+        plan["full"] = f"flowtable 设备变化: {live_devices} -> {devices}"
+        plan["drop_flowtable"] = ft is not None
+        plan["rules_add"] = ir["rules"]
+        return plan
+    changed = [n for n in plan["sets_del"] if n in ir["sets"]]
+    if changed:
+        plan["full"] = f"集合 {', '.join(changed)} 类型变化"
+        plan["rules_add"] = ir["rules"]
+        return plan
+    for name, spec in ir["sets"].items():
+        cur = live.sets.get(name)
+        if cur is None:
+            plan["sets_add"][name] = spec
+            continue
+        if spec.get("dynamic"):
+            continue
+        have = set(cur.elements)
+        want = set(spec["elements"])
+        if want - have:
+            plan["elements_add"][name] = [e for e in spec["elements"] if e not in have]
+        if have - want:
+            plan["elements_del"][name] = [e for e in cur.elements if e not in want]
+    desired = [rule_id(r) for r in ir["rules"]]
+    rules = [r for r in live.rules if r.chain == CHAIN_PREROUTING]
+    current = [r.comment for r in rules]
+    if current == desired:
+        return plan
+    kept = [c for c in current if c in desired]
+    if len(set(current)) != len(current) or kept != [d for d in desired if d in set(kept)]:
+        # 保留的规则之间顺序变化，只能清空链后按顺序重建
+        plan["rebuild"] = True
+        plan["rules_del"] = rules
+        plan["rules_add"] = ir["rules"]
+        return plan
+    # 删除多余规则，新增规则插入到其后第一条保留规则之前（没有则追加到链尾），其余规则保留计数器
+    plan["rules_del"] = [r for r in rules if r.comment not in desired]
+    handles = {r.comment: r.handle for r in rules}
+    before = None
+    for rule, rid in reversed(list(zip(ir["rules"], desired))):
+        if rid in handles:
+            before = handles[rid]
+        elif before is None:
+            plan["rules_add"].insert(0, rule)
+        else:
+            plan["rules_insert"].insert(0, (rule, before))
+    return plan
+
+def is_empty(plan: dict) -> bool:
+    return not (plan["full"] or plan["rebuild"] or plan["rules_add"] or plan["rules_insert"] or plan["rules_del"] or plan["sets_add"]
+                or plan["sets_del"] or plan["elements_add"] or plan["elements_del"] or plan["ufw"])
+
+def describe(plan: dict) -> list:
+    lines = []
+    if plan["full"]:
+        lines.append(f"全量应用: {plan['full']}")
+    for port, proto, container in plan["ufw"]:
+        lines.append(f"+ ufw {'ufw-docker ' + container + ' ' if container else ''}allow {port}/{proto}")
+    for name, spec in plan["sets_add"].items():
+        lines.append(f"+ set {name} ({len(spec['elements'])} 个元素)")
+    for name in plan["sets_del"]:
+        lines.append(f"- set {name}")
+    for name, elems in plan["elements_del"].items():
+        lines += [f"- element {name} {{ {e} }}" for e in elems]
+    for name, elems in plan["elements_add"].items():
+        lines += [f"+ element {name} {{ {e} }}" for e in elems]
+    if plan["rebuild"]:
+        lines.append("重建规则链（规则顺序或内容变化）")
+    if not plan["full"]:
+        lines += [f"- rule [handle {r.handle}] {r.comment}" for r in plan["rules_del"] if not plan["rebuild"]]
+    lines += [f"+ rule {r} (插入到 handle {h} 之前)" for r, h in plan["rules_insert"]]
+    lines += [f"+ rule {r}" for r in plan["rules_add"]]
+    return lines
+
+def script(plan: dict) -> str:
+    lines = []
+    if plan["rebuild"]:
+        lines.append(f"flush chain {TABLE} {TABLE_NAME} {CHAIN_PREROUTING}")
+    else:
+        lines += [f"delete rule {TABLE} {TABLE_NAME} {r.chain} handle {r.handle}" for r in plan["rules_del"]]
+    lines += [f"delete set {TABLE} {TABLE_NAME} {name}" for name in plan["sets_del"]]
+    for name, spec in plan["sets_add"].items():
+        lines.append(set_decl(name, spec))
+        if spec["elements"]:
+            lines.append(f"add element {TABLE} {TABLE_NAME} {name} {{ {', '.join(spec['elements'])} }}")
+    for name, elems in plan["elements_del"].items():
+        lines.append(f"delete element {TABLE} {TABLE_NAME} {name} {{ {', '.join(elems)} }}")
+    for name, elems in plan["elements_add"].items():
+        lines.append(f"add element {TABLE} {TABLE_NAME} {name} {{ {', '.join(elems)} }}")
+    lines += [insert_line(r, h) for r, h in plan["rules_insert"]]
+    lines += [rule_line(r) for r in plan["rules_add"]]
+    return "\n".join(lines) + "\n" if lines else ""
+
+def execute(cfg: dict, plan: dict) -> tuple:
+    # 返回 (是否成功, 输出信息列表)
+    out = []
+    out += batch_allow(plan["ufw"])
+    if plan["full"]:
+        text, _ = render(cfg, count_set_elements(), plan["drop_flowtable"], plan["recreate_chain"], plan["sets_del"])
+    else:
+        text = script(plan)
+    if text:
+        r = load_script(text)
+        if r is not None and r.returncode != 0:
+            out.append(r.stderr)
+            return False, out
+    return True, out
@@ -0,0 +1,278 @@
+import hashlib
+import re
+from .cidr import aggregate
+from .nft import TABLE, TABLE_NAME, CHAIN_PREROUTING, CHAIN_FORWARD, SET_NAME, FLOWTABLE
+
+PRIVATE_CIDRS = ["127.0.0.0/8", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+
+RATE_RE = re.compile(r"^\d+/(second|minute|hour|day)$")
+TIME_RE = re.compile(r"^(\d+[dhms])+$")
+# 计量集合的元素超时取速率单位的两倍（至少 1 分钟），空闲来源的令牌桶会被回收
+METER_TIMEOUT = {"second": "1m", "minute": "2m", "hour": "2h", "day": "2d"}
+METER_SIZE = 65535
+BAN_SET = "cnwall_ban"
+RATE_SET_PREFIX = "cnwall_rl_"
+
+def normalize_rate_limit(v, port: int) -> dict | None:
+    # 支持简写 rate_limit: "20/minute"
+    if not v:
+        return None
+    if isinstance(v, str):
+        v = {"rate": v}
+    rate = str(v.get("rate", "")).replace(" ", "")
+    ban = str(v.get("ban", "10m"))
+    if not RATE_RE.match(rate) or not TIME_RE.match(ban):
+        raise ValueError(f"端口 {port} 的 rate_limit 配置无效: {v}")
+    return {"rate": rate, "burst": int(v.get("burst", 5)), "ban": ban}
+
+def normalize_port(p: dict) -> dict:
+    protos = p.get("protos")
+    if not protos:
+        proto_single = p.get("proto")
+        protos = [proto_single] if proto_single else ["tcp"]
+    policy = p.get("china_policy", "none")
+    if policy == True:
+        policy = "block_china"
+    return {
+        "port": int(p.get("port")),
+        "protos": list(protos),
+        "open": bool(p.get("open", True)),
+        "china_policy": policy,
+        "container": p.get("container", "") or "",
+        "whitelist_cidrs": list(p.get("whitelist_cidrs", []) or []),
+        "blacklist_cidrs": list(p.get("blacklist_cidrs", []) or []),
+        "rate_limit": normalize_rate_limit(p.get("rate_limit"), int(p.get("port"))),
+    }
+
+def normalize_ports(cfg: dict) -> list:
+    return [normalize_port(p) for p in cfg.get("ports", []) or []]
+
+def port_whitelist(cfg: dict, p: dict) -> list:
+    whitelist = []
+    if bool(cfg.get("allow_private", True)):
+        whitelist += PRIVATE_CIDRS
+    whitelist += cfg.get("whitelist_cidrs", []) or []
+    whitelist += p["whitelist_cidrs"]
+    return aggregate(whitelist)
+
+def port_blacklist(cfg: dict, p: dict) -> list:
+    return aggregate((cfg.get("blacklist_cidrs", []) or []) + p["blacklist_cidrs"])
+
+POLICY_PORT_SETS = {
+    "block_china": "cnwall_ports_block_china",
+    "block_non_china": "cnwall_ports_block_non_china",
+}
+PORT_SET_TYPE = "inet_proto . inet_service"
+CIDR_SET_TYPE = "ipv4_addr"
+CIDR_PORT_SET_TYPE = "ipv4_addr . inet_proto . inet_service"
+COMPACT_SETS = {
+    "cnwall_ports": PORT_SET_TYPE,
+    "cnwall_whitelist": CIDR_SET_TYPE,
+    "cnwall_blacklist": CIDR_SET_TYPE,
+    "cnwall_whitelist_port": CIDR_PORT_SET_TYPE,
+    "cnwall_blacklist_port": CIDR_PORT_SET_TYPE,
+    "cnwall_ports_block_china": PORT_SET_TYPE,
+    "cnwall_ports_block_non_china": PORT_SET_TYPE,
+}
+# conntrack 在 prerouting 的优先级为 -200，docker 的 DNAT 为 -100；
+# 快速路径需要 ct state，链必须挂在两者之间，才能既拿到连接状态又匹配到 DNAT 之前的端口
+CONNTRACK_PRIORITY = -200
+FASTPATH_PRIORITY = -150
+FASTPATH_RULE = "ct state established,related counter accept"
+FLOWTABLE_RULE = f"meta l4proto {{ tcp, udp }} flow add @{FLOWTABLE}"
+
+# set_counters 开启时为这些集合的元素附加计数器，用于按端口统计命中
+COUNTER_SETS = ("cnwall_whitelist_port", "cnwall_blacklist_port", "cnwall_ports_block_china", "cnwall_ports_block_non_china")
+
+def cidr_rules(cfg: dict, p: dict) -> list:
+    rules = []
+    port = p["port"]
+    for proto in p["protos"]:
+        for cidr in port_whitelist(cfg, p):
+            rules.append(f"{proto} dport {port} ip saddr {cidr} counter accept")
+    for proto in p["protos"]:
+        for cidr in port_blacklist(cfg, p):
+            rules.append(f"{proto} dport {port} ip saddr {cidr} counter drop")
+    return rules
+
+def build_expanded(cfg: dict, china_count: int) -> dict:
+    rules = []
+    skipped = []
+    for p in normalize_ports(cfg):
+        port = p["port"]
+        protos = p["protos"]
+        rules += cidr_rules(cfg, p)
+        if p["china_policy"] == "block_china":
+            for proto in protos:
+                rules.append(f"{proto} dport {port} ip saddr @{SET_NAME} counter drop")
+        elif p["china_policy"] == "block_non_china":
+            if china_count > 0:
+                for proto in protos:
+                    rules.append(f"{proto} dport {port} ip saddr != @{SET_NAME} counter drop")
+            else:
+                skipped.append(port)
+    return {"sets": {}, "rules": rules, "skipped": skipped}
+
+def build_compact(cfg: dict, china_count: int) -> dict:
+    # 全局黑白名单与端口集合、端口级黑白名单与 "地址 . 协议 . 端口" 拼接集合、
+    # china_policy 与端口集合各对应一条规则，规则数不随端口数和名单长度增长
+    skipped = []
+    elements = {name: [] for name in COMPACT_SETS}
+    ports = normalize_ports(cfg)
+    whitelist = list(PRIVATE_CIDRS) if bool(cfg.get("allow_private", True)) else []
+    whitelist += cfg.get("whitelist_cidrs", []) or []
+    elements["cnwall_whitelist"] = aggregate(whitelist)
+    elements["cnwall_blacklist"] = aggregate(cfg.get("blacklist_cidrs", []) or [])
+    for p in ports:
+        port = p["port"]
+        keys = [f"{proto} . {port}" for proto in p["protos"]]
+        elements["cnwall_ports"] += keys
+        for cidr in aggregate(p["whitelist_cidrs"]):
+            elements["cnwall_whitelist_port"] += [f"{cidr} . {k}" for k in keys]
+        for cidr in aggregate(p["blacklist_cidrs"]):
+            elements["cnwall_blacklist_port"] += [f"{cidr} . {k}" for k in keys]
+        policy = p["china_policy"]
+        if policy == "block_non_china" and china_count <= 0:
+            skipped.append(port)
+            continue
+        if policy in POLICY_PORT_SETS:
+            elements[POLICY_PORT_SETS[policy]] += keys
+    sets = {}
+    for name, type_ in COMPACT_SETS.items():
+        if not elements[name]:
+            continue
+        flags = ["interval"] if type_ != PORT_SET_TYPE else []
+        counter = bool(cfg.get("set_counters", False)) and name in COUNTER_SETS
+        sets[name] = {"type": type_, "flags": flags, "counter": counter, "elements": list(dict.fromkeys(elements[name]))}
+    rules = []
+    if "cnwall_ports" in sets:
+        if "cnwall_whitelist" in sets:
+            rules.append("ip saddr @cnwall_whitelist meta l4proto . th dport @cnwall_ports counter accept")
+        if "cnwall_whitelist_port" in sets:
+            rules.append("ip saddr . meta l4proto . th dport @cnwall_whitelist_port counter accept")
+        if "cnwall_blacklist" in sets:
+            rules.append("ip saddr @cnwall_blacklist meta l4proto . th dport @cnwall_ports counter drop")
+        if "cnwall_blacklist_port" in sets:
+            rules.append("ip saddr . meta l4proto . th dport @cnwall_blacklist_port counter drop")
+    for policy, name in POLICY_PORT_SETS.items():
+        if name not in sets:
+            continue
+        saddr = f"ip saddr != @{SET_NAME}" if policy == "block_non_china" else f"ip saddr @{SET_NAME}"
+        rules.append(f"{saddr} meta l4proto . th dport @{name} counter drop")
+    return {"sets": sets, "rules": rules, "skipped": skipped}
+
+def rate_limit_rules(cfg: dict) -> tuple:
+    # 每个限速端口一个动态计量集合（按来源 IP 的令牌桶），超限的新连接把 "来源 . 协议 . 端口"
+    # 写入带超时的 cnwall_ban 并丢弃；封禁期内该来源访问此端口的报文由第一条规则直接丢弃
+    sets = {}
+    rules = []
+    for p in normalize_ports(cfg):
+        rl = p["rate_limit"]
+        if not rl:
+            continue
+        name = f"{RATE_SET_PREFIX}{p['port']}"
+        unit = rl["rate"].split("/")[1]
+        sets[name] = {"type": CIDR_SET_TYPE, "flags": ["dynamic", "timeout"], "timeout": METER_TIMEOUT[unit], "size": METER_SIZE, "dynamic": True, "elements": []}
+        for proto in p["protos"]:
+            rules.append(
+                f"ct state new {proto} dport {p['port']} update @{name} {{ ip saddr limit rate over {rl['rate']} burst {rl['burst']} packets }} "
+                f"update @{BAN_SET} {{ ip saddr . meta l4proto . th dport timeout {rl['ban']} }} counter drop"
+            )
+    if rules:
+        sets[BAN_SET] = {"type": CIDR_PORT_SET_TYPE, "flags": ["dynamic", "timeout"], "size": METER_SIZE, "dynamic": True, "elements": []}
+        rules.insert(0, f"ip saddr . meta l4proto . th dport @{BAN_SET} counter drop")
+    return sets, rules
+
+def is_rate_set(name: str) -> bool:
+    return name == BAN_SET or name.startswith(RATE_SET_PREFIX)
+
+def fastpath(cfg: dict) -> bool:
+    return bool(cfg.get("conntrack_fastpath", False))
+
+def needs_conntrack(cfg: dict) -> bool:
+    return fastpath(cfg) or any(p["rate_limit"] for p in normalize_ports(cfg))
+
+def chain_priority(cfg: dict) -> int:
+    priority = int(cfg.get("prerouting_priority", -350))
+    if needs_conntrack(cfg) and priority <= CONNTRACK_PRIORITY:
+        return FASTPATH_PRIORITY
+    return priority
+
+def flowtable_devices(cfg: dict) -> list:
+    return sorted(set(cfg.get("flowtable_devices", []) or []))
+
+def build(cfg: dict, china_count: int) -> dict:
+    if cfg.get("rule_layout", "expanded") == "compact":
+        ir = build_compact(cfg, china_count)
+    else:
+        ir = build_expanded(cfg, china_count)
+    # 限速规则放在黑白名单与 china 策略之后：白名单来源不会被封禁，已被拦截的报文也不计入速率
+    rate_sets, rate_rules = rate_limit_rules(cfg)
+    ir["sets"].update(rate_sets)
+    ir["rules"] += rate_rules
+    if fastpath(cfg):
+        # 已建立连接的后续报文直接放行，只有新连接才走黑白名单与 china 集合匹配
+        ir["rules"].insert(0, FASTPATH_RULE)
+    return ir
+
+def rule_id(rule: str) -> str:
+    # 写入规则 comment，用于把内核中的规则与期望规则逐条对应
+    return "cnwall:" + hashlib.sha1(rule.encode("utf-8")).hexdigest()[:12]
+
+def rule_line(rule: str) -> str:
+    return f"add rule {TABLE} {TABLE_NAME} {CHAIN_PREROUTING} {rule} comment \"{rule_id(rule)}\""
+
+def insert_line(rule: str, handle: int) -> str:
+    # 插入到指定句柄的规则之前
+    return f"insert rule {TABLE} {TABLE_NAME} {CHAIN_PREROUTING} position {handle} {rule} comment \"{rule_id(rule)}\""
+
+def set_decl(name: str, spec: dict) -> str:
+    flags = f" flags {', '.join(spec['flags'])};" if spec["flags"] else ""
+    counter = " counter;" if spec.get("counter") else ""
+    timeout = f" timeout {spec['timeout']};" if spec.get("timeout") else ""
+    size = f" size {spec['size']};" if spec.get("size") else ""
+    return f"add set {TABLE} {TABLE_NAME} {name} {{ type {spec['type']};{flags}{counter}{timeout}{size} }}"
+
+def flowtable_lines(cfg: dict, drop_flowtable: bool = False) -> list:
+    # drop_flowtable：内核中已有的 flowtable 需要先删除（设备变化或关闭 flowtable_devices）
+    devices = flowtable_devices(cfg)
+    lines = [
+        f"add chain {TABLE} {TABLE_NAME} {CHAIN_FORWARD} {{ type filter hook forward priority 0; policy accept; }}",
+        f"flush chain {TABLE} {TABLE_NAME} {CHAIN_FORWARD}",
+    ]
+    if drop_flowtable:
+        lines.append(f"delete flowtable {TABLE} {TABLE_NAME} {FLOWTABLE}")
+    if not devices:
+        lines.append(f"delete chain {TABLE} {TABLE_NAME} {CHAIN_FORWARD}")
+        return lines
+    lines.append(f"add flowtable {TABLE} {TABLE_NAME} {FLOWTABLE} {{ hook ingress priority 0; devices = {{ {', '.join(devices)} }}; }}")
+    lines.append(f"add rule {TABLE} {TABLE_NAME} {CHAIN_FORWARD} {FLOWTABLE_RULE} comment \"{rule_id(FLOWTABLE_RULE)}\"")
+    return lines
+
+def render(cfg: dict, china_count: int, drop_flowtable: bool = False, recreate_chain: bool = False, drop_sets: list = ()) -> tuple:
+    # recreate_chain：已有链的优先级与配置不同，add chain 无法修改 hook 优先级，需先删除
+    # drop_sets：内核中需要删除的集合（已不再使用，或类型/flags/counter 与期望不同需要重建），在清空链之后删除
+    priority = chain_priority(cfg)
+    ir = build(cfg, china_count)
+    lines = [f"add table {TABLE} {TABLE_NAME}"]
+    if recreate_chain:
+        lines.append(f"flush chain {TABLE} {TABLE_NAME} {CHAIN_PREROUTING}")
+        lines.append(f"delete chain {TABLE} {TABLE_NAME} {CHAIN_PREROUTING}")
+    lines += [
+        f"add chain {TABLE} {TABLE_NAME} {CHAIN_PREROUTING} {{ type filter hook prerouting priority {priority}; policy accept; }}",
+        f"add set {TABLE} {TABLE_NAME} {SET_NAME} {{ type ipv4_addr; flags interval; }}",
+        f"flush chain {TABLE} {TABLE_NAME} {CHAIN_PREROUTING}",
+    ]
+    lines += [f"delete set {TABLE} {TABLE_NAME} {name}" for name in drop_sets]
+    for name, spec in ir["sets"].items():
+        lines.append(set_decl(name, spec))
+        if spec.get("dynamic"):
+            # 动态集合的元素由内核维护（计量状态与封禁记录），重新应用时保留
+            continue
+        lines.append(f"flush set {TABLE} {TABLE_NAME} {name}")
+        if spec["elements"]:
+            lines.append(f"add element {TABLE} {TABLE_NAME} {name} {{ {', '.join(spec['elements'])} }}")
+    for r in ir["rules"]:
+        lines.append(rule_line(r))
+    lines += flowtable_lines(cfg, drop_flowtable)
+    return "\n".join(lines) + "\n", ir["skipped"]
@@ -0,0 +1,78 @@
+import hashlib
+import http.client
+import json
+import os
+import urllib.error
+import urllib.request
+from .cidr import parse_line
+from .config import STATE_DIR
+
+CACHE_DIR = os.path.join(STATE_DIR, "sources")
+
+def cache_paths(url: str) -> tuple:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{key}.txt"), os.path.join(CACHE_DIR, f"{key}.json")
+
+def load_meta(url: str) -> dict:
+    data_path, meta_path = cache_paths(url)
+    if not os.path.exists(data_path) or not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def parse_cached(url: str) -> list:
+    data_path, _ = cache_paths(url)
+    nets = []
+    with open(data_path, "r", encoding="utf-8") as f:
+        for line in f:
+            nets += parse_line(line)
+    return nets
+
+def fetch(url: str, timeout: int = 30) -> tuple:
+    # 返回 (网段列表, 是否有变化)；304 或下载失败时使用本地缓存
+    data_path, meta_path = cache_paths(url)
+    meta = load_meta(url)
+    req = urllib.request.Request(url)
+    if meta.get("etag"):
+        req.add_header("If-None-Match", meta["etag"])
+    if meta.get("last_modified"):
+        req.add_header("If-Modified-Since", meta["last_modified"])
+    try:
+        resp = urllib.request.urlopen(req, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta:
+            return parse_cached(url), False
+        return fallback(url, e)
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+        return fallback(url, e)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = data_path + ".tmp"
+    nets = []
+    try:
+        with resp, open(tmp, "w", encoding="utf-8") as out:
+            for raw in resp:
+                line = raw.decode("utf-8", errors="replace")
+                out.write(line)
+                nets += parse_line(line)
+            # 逐行迭代在 EOF 处静默结束；剩余长度大于 0 说明响应体短于 Content-Length
+            if getattr(resp, "length", None):
+                raise http.client.IncompleteRead(b"", resp.length)
+        if not nets:
+            raise ValueError("下载内容中没有可用的网段")
+    except (http.client.HTTPException, OSError, ValueError) as e:
+        os.remove(tmp)
+        return fallback(url, e)
+    # 只有完整且非空的下载才替换缓存与 ETag，否则之后的 304 会一直复用错误的列表
+    os.replace(tmp, data_path)
+    new_meta = {"url": url, "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(new_meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return nets, True
+
+def fallback(url: str, err: Exception) -> tuple:
+    data_path, _ = cache_paths(url)
+    if not os.path.exists(data_path):
+        raise err
+    print(f"警告: 下载 {url} 失败({err})，使用本地缓存")
+    return parse_cached(url), False
@@ -0,0 +1,172 @@
+import ipaddress
+import json
+from dataclasses import dataclass, field
+from .system import has_cmd, run_cmd
+
+TABLE = "inet"
+TABLE_NAME = "cnwall"
+
+@dataclass
+class Rule:
+    chain: str
+    handle: int
+    expr: list
+    comment: str = ""
+    proto: str = ""
+    dport: int | None = None
+    saddr: str = ""
+    saddr_neg: bool = False
+    ct_state: str = ""
+    sets: list = field(default_factory=list)
+    verdict: str = ""
+    packets: int = 0
+    bytes: int = 0
+
+@dataclass
+class Set:
+    name: str
+    type: str
+    flags: list
+    elements: list
+    extra: dict = field(default_factory=dict)
+    counter: bool = False
+
+@dataclass
+class Table:
+    exists: bool = False
+    chains: dict = field(default_factory=dict)
+    rules: list = field(default_factory=list)
+    sets: dict = field(default_factory=dict)
+    flowtables: dict = field(default_factory=dict)
+    error: str = ""
+
+    def set_count(self, name: str) -> int:
+        s = self.sets.get(name)
+        return len(s.elements) if s else 0
+
+    def find_rules(self, chain: str | None = None, **match) -> list:
+        found = []
+        for r in self.rules:
+            if chain and r.chain != chain:
+                continue
+            if all(getattr(r, k) == v for k, v in match.items()):
+                found.append(r)
+        return found
+
+_cache: Table | None = None
+
+def invalidate() -> None:
+    global _cache
+    _cache = None
+
+def load(refresh: bool = False) -> Table:
+    global _cache
+    if _cache is not None and not refresh:
+        return _cache
+    if not has_cmd("nft"):
+        _cache = Table()
+        return _cache
+    r = run_cmd(["nft", "-j", "list", "table", TABLE, TABLE_NAME])
+    if r.returncode != 0 or not r.stdout.strip():
+        _cache = Table()
+        return _cache
+    try:
+        data = json.loads(r.stdout)
+    except ValueError as e:
+        # 旧版 nft 不支持 -j，或把错误信息输出到了 stdout；按表不存在处理并保留原因
+        _cache = Table(error=f"无法解析 nft -j 输出: {e}: {r.stdout.strip()[:80]!r}")
+        return _cache
+    _cache = parse(data if isinstance(data, dict) else {})
+    return _cache
+
+def parse(data: dict) -> Table:
+    t = Table(exists=True)
+    for obj in data.get("nftables", []):
+        if "chain" in obj:
+            c = obj["chain"]
+            t.chains[c["name"]] = c
+        elif "flowtable" in obj:
+            f = obj["flowtable"]
+            t.flowtables[f["name"]] = f
+        elif "set" in obj or "map" in obj:
+            s = obj.get("set") or obj.get("map")
+            type_ = s.get("type", "")
+            if isinstance(type_, list):
+                type_ = " . ".join(type_)
+            elements = []
+            extra = {}
+            for e in s.get("elem", []):
+                meta = {}
+                if isinstance(e, dict) and "elem" in e:
+                    meta = {k: v for k, v in e["elem"].items() if k != "val"}
+                    e = e["elem"]["val"]
+                for key in element_keys(e):
+                    elements.append(key)
+                    if meta:
+                        extra[key] = meta
+            counter = any("counter" in st for st in s.get("stmt", []))
+            t.sets[s["name"]] = Set(name=s["name"], type=type_, flags=list(s.get("flags", [])), elements=elements, extra=extra, counter=counter)
+        elif "rule" in obj:
+            t.rules.append(parse_rule(obj["rule"]))
+    return t
+
+def value_str(v) -> str:
+    if isinstance(v, dict):
+        if "prefix" in v:
+            return f"{v['prefix']['addr']}/{v['prefix']['len']}"
+        if "concat" in v:
+            return " . ".join(value_str(x) for x in v["concat"])
+        if "range" in v:
+            return "-".join(value_str(x) for x in v["range"])
+        if "set" in v:
+            return "{" + ", ".join(value_str(x) for x in v["set"]) + "}"
+    return str(v)
+
+def norm_addr(v: str) -> str:
+    try:
+        return str(ipaddress.IPv4Network(v, strict=False))
+    except ValueError:
+        return v
+
+def element_keys(e) -> list:
+    if isinstance(e, dict) and "range" in e:
+        lo, hi = e["range"]
+        try:
+            nets = ipaddress.summarize_address_range(ipaddress.IPv4Address(lo), ipaddress.IPv4Address(hi))
+            return [str(n) for n in nets]
+        except (ValueError, TypeError):
+            return [value_str(e)]
+    if isinstance(e, dict) and "concat" in e:
+        return [" . ".join(element_keys(x)[0] for x in e["concat"])]
+    v = value_str(e)
+    return [norm_addr(v) if "." in v and " " not in v else v]
+
+def parse_rule(r: dict) -> Rule:
+    rule = Rule(chain=r.get("chain", ""), handle=int(r.get("handle", 0)), expr=r.get("expr", []), comment=r.get("comment", ""))
+    for st in rule.expr:
+        if "match" in st:
+            m = st["match"]
+            left = m.get("left", {})
+            right = m.get("right")
+            payload = left.get("payload") if isinstance(left, dict) else None
+            if isinstance(left, dict) and left.get("ct", {}).get("key") == "state":
+                rule.ct_state = ",".join(right) if isinstance(right, list) else str(right)
+            elif payload and payload.get("field") == "dport" and payload.get("protocol") in ("tcp", "udp"):
+                rule.proto = payload["protocol"]
+                if isinstance(right, int):
+                    rule.dport = right
+            elif payload and payload.get("protocol") == "ip" and payload.get("field") == "saddr":
+                rule.saddr = norm_addr(value_str(right))
+                rule.saddr_neg = m.get("op") == "!="
+            if isinstance(right, str) and right.startswith("@"):
+                rule.sets.append(right[1:])
+        elif "set" in st and isinstance(st["set"], dict):
+            rule.sets.append(str(st["set"].get("set", "")).lstrip("@"))
+        elif "counter" in st and isinstance(st["counter"], dict):
+            rule.packets = st["counter"].get("packets", 0)
+            rule.bytes = st["counter"].get("bytes", 0)
+        else:
+            for v in ("accept", "drop", "jump", "goto", "return"):
+                if v in st:
+                    rule.verdict = v
+    return rule
@@ -1,8 +1,108 @@
+import json
+import os
 import subprocess
 import shutil
+import sys
+import threading
+import time
+
+# 外部命令计时：设置环境变量 CNWALL_TRACE（1 或 JSON 输出路径）或使用 --trace 开启，
+# 按 CLI 命令分组记录每次子进程调用的参数摘要、耗时、退出码与调用位置
+TRACE_TOP = int(os.environ.get("CNWALL_TRACE_TOP", "10"))
+_trace: dict | None = None
+_trace_lock = threading.Lock()
 
 def has_cmd(name: str) -> bool:
     return shutil.which(name) is not None
 
-def run_cmd(args, capture_output: bool = True, input: str | None = None) -> subprocess.CompletedProcess:
-    return subprocess.run(args, capture_output=capture_output, text=True, input=input)
+def enable_trace(path: str | None = None) -> None:
+    global _trace
+    if _trace is not None:
+        return
+    env = os.environ.get("CNWALL_TRACE", "")
+    if not path and env not in ("", "0", "1"):
+        path = env
+    if not path:
+        from .config import STATE_DIR
+        path = os.path.join(STATE_DIR, "trace", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+    _trace = {"path": path, "groups": [], "current": None}
+
+def trace_begin(command: str) -> None:
+    if _trace is None:
+        return
+    group = {"command": command, "started": time.time(), "wall_ms": 0.0, "calls": []}
+    _trace["groups"].append(group)
+    _trace["current"] = group
+
+def argv_summary(args) -> str:
+    text = " ".join(str(a) for a in args[:6])
+    if len(args) > 6:
+        text += f" …(+{len(args) - 6})"
+    return text if len(text) <= 120 else text[:117] + "..."
+
+def _record(args, start: float, returncode: int | None, popen: bool = False) -> None:
+    group = _trace["current"] if _trace else None
+    if group is None:
+        return
+    frame = sys._getframe(2)
+    caller = f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}:{frame.f_lineno}"
+    call = {
+        "argv": argv_summary(args),
+        "tool": os.path.basename(str(args[0])) if args else "",
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+        "rc": returncode,
+        "caller": caller,
+        "thread": threading.current_thread().name,
+    }
+    if popen:
+        call["popen"] = True
+    with _trace_lock:
+        group["calls"].append(call)
+
+def trace_end() -> list:
+    # 写出 JSON 并返回本次命令的摘要行
+    if _trace is None or _trace["current"] is None:
+        return []
+    group = _trace["current"]
+    _trace["current"] = None
+    group["wall_ms"] = round((time.time() - group["started"]) * 1000, 2)
+    os.makedirs(os.path.dirname(os.path.abspath(_trace["path"])), exist_ok=True)
+    with open(_trace["path"], "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "commands": _trace["groups"]}, f, ensure_ascii=False, indent=2)
+    return trace_report(group) + [f"trace: {_trace['path']}"]
+
+def trace_report(group: dict, top: int = TRACE_TOP) -> list:
+    calls = group["calls"]
+    spent = sum(c["ms"] for c in calls)
+    lines = [f"trace: {group['command']} 共 {len(calls)} 次外部调用，子进程累计 {spent:.1f}ms，命令总耗时 {group['wall_ms']:.1f}ms"]
+    tools = {}
+    for c in calls:
+        n, ms = tools.get(c["tool"], (0, 0.0))
+        tools[c["tool"]] = (n + 1, ms + c["ms"])
+    for tool, (n, ms) in sorted(tools.items(), key=lambda x: -x[1][1]):
+        lines.append(f"  {tool:<12} {n:>5} 次 {ms:>10.1f}ms")
+    if calls:
+        lines.append(f"最慢的 {min(top, len(calls))} 次调用:")
+    for c in sorted(calls, key=lambda c: -c["ms"])[:top]:
+        lines.append(f"  {c['ms']:>9.1f}ms rc={c['rc']} {c['argv']}  ({c['caller']})")
+    return lines
+
+def run_cmd(args, capture_output: bool = True, input: str | None = None, **kwargs) -> subprocess.CompletedProcess:
+    if _trace is None:
+        return subprocess.run(args, capture_output=capture_output, text=True, input=input, **kwargs)
+    start = time.perf_counter()
+    try:
+        r = subprocess.run(args, capture_output=capture_output, text=True, input=input, **kwargs)
+    except (OSError, subprocess.TimeoutExpired):
+        _record(args, start, -1)
+        raise
+    _record(args, start, r.returncode)
+    return r
+
+def popen(args) -> subprocess.Popen:
+    # 长期运行的子进程（如 docker events）只记录启动耗时
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    if _trace is not None:
+        _record(args, start, None, popen=True)
+    return proc
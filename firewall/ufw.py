@@ -1,11 +1,65 @@
+import os
+from .docker_ports import container_ips
 from .system import has_cmd, run_cmd
 
+UFW_DIR = os.environ.get("CNWALL_UFW_DIR") or "/etc/ufw"
+USER_RULES = os.path.join(UFW_DIR, "user.rules")
+USER6_RULES = os.path.join(UFW_DIR, "user6.rules")
+END_MARK = "### END RULES ###"
+TUPLE_MARK = "### tuple ### "
+
 def status() -> str:
     if not has_cmd("ufw"):
         return "ufw未安装"
     r = run_cmd(["ufw", "status"])
     return r.stdout or r.stderr
 
+def added_rules() -> tuple | None:
+    # 解析 `ufw show added`（ufw 未启用时同样可用），返回 (端口规则集合, {(容器, 端口, 协议): 已放行的容器 IP 集合})
+    # ufw 未安装或命令失败（如非 root）时无法得知已有规则，返回 None
+    ports = set()
+    containers = {}
+    if not has_cmd("ufw"):
+        return None
+    r = run_cmd(["ufw", "show", "added"])
+    if r.returncode != 0:
+        return None
+    for line in r.stdout.splitlines():
+        parts = line.split()
+        if parts[:2] == ["ufw", "allow"] and len(parts) == 3:
+            if "/" in parts[2]:
+                ports.add(parts[2])
+            else:
+                ports.update({f"{parts[2]}/tcp", f"{parts[2]}/udp"})
+        elif parts[:3] == ["ufw", "route", "allow"] and "comment" in line:
+            comment = line.split("comment", 1)[1].strip().strip("'\"").split()
+            if len(comment) >= 3 and comment[0] == "allow" and "/" in comment[2]:
+                port, proto = comment[2].split("/", 1)
+                ips = containers.setdefault((comment[1], port, proto), set())
+                if "to" in parts:
+                    ips.add(parts[parts.index("to") + 1])
+    return ports, containers
+
+def pending(rules: list) -> list:
+    # rules: [(port, proto, container)]；只保留尚未放行、或容器 IP 与已有放行规则不一致的条目
+    # 容器未运行时无法确定 IP，跳过，等容器启动事件再补充；已有规则未知时不报告缺失，避免每次 apply 都重复执行
+    added = added_rules()
+    if added is None:
+        return []
+    ports, containers = added
+    ips = {}
+    out = []
+    for port, proto, container in rules:
+        if not container:
+            if f"{port}/{proto}" not in ports:
+                out.append((port, proto, container))
+            continue
+        if container not in ips:
+            ips[container] = set(container_ips(container))
+        if ips[container] and containers.get((container, str(port), proto)) != ips[container]:
+            out.append((port, proto, container))
+    return out
+
 def docker_available() -> bool:
     return has_cmd("ufw-docker")
 
@@ -27,3 +81,125 @@ def allow_docker(container: str, port: int, proto: str = "tcp") -> str:
     r = run_cmd(["ufw-docker", "allow", container, str(port), proto])
     return r.stdout or r.stderr
 
+
+def rules_writable() -> bool:
+    if not os.path.exists(USER_RULES) or not os.access(USER_RULES, os.W_OK):
+        return False
+    with open(USER_RULES, "r", encoding="utf-8") as f:
+        return END_MARK in f.read()
+
+def read_tuples(path: str) -> list:
+    # 返回 [(tuple 行, 字段列表, 注释)]；字段为 动作 协议 目标端口 目标地址 源端口 源地址 方向
+    if not os.path.exists(path):
+        return []
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith(TUPLE_MARK):
+                continue
+            line = line.rstrip("\n")
+            fields = line[len(TUPLE_MARK):].split()
+            comment = ""
+            if fields and fields[-1].startswith("comment="):
+                try:
+                    comment = bytes.fromhex(fields.pop()[len("comment="):]).decode("utf-8")
+                except ValueError:
+                    comment = ""
+            out.append((line, fields, comment))
+    return out
+
+def plain_allows(tuples: list) -> set:
+    # 对任意来源放行的宿主端口，协议为 any 时同时覆盖 tcp/udp
+    out = set()
+    for _, f, _ in tuples:
+        if len(f) >= 6 and f[0] == "allow" and f[3] in ("0.0.0.0/0", "::/0") and f[5] in ("0.0.0.0/0", "::/0"):
+            out.update({(f[2], "tcp"), (f[2], "udp")} if f[1] == "any" else {(f[2], f[1])})
+    return out
+
+def update_rules(path: str, blocks: list, remove: set) -> None:
+    # 与 ufw 自身写入的格式一致：tuple 注释行 + iptables 规则行，新规则插入到 END RULES 之前；
+    # remove 中的 tuple 行连同其后的规则行与空行一并删除
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    if END_MARK not in lines or not (blocks or remove):
+        return
+    out = []
+    skip = False
+    for line in lines:
+        if line.startswith("###"):
+            skip = line in remove
+        if skip:
+            if not line.strip():
+                skip = False
+            continue
+        if line == END_MARK:
+            for b in blocks:
+                out += b.split("\n") + [""]
+            blocks = []
+        out.append(line)
+    tmp = path + ".cnwall.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(out))
+    os.chmod(tmp, os.stat(path).st_mode & 0o777)
+    os.replace(tmp, path)
+
+def batch_allow(rules: list) -> list:
+    # rules: [(port, proto, container)]；直接写入 ufw 的 user rules 文件，最后只执行一次 `ufw reload`
+    # 与 ufw-docker 一致：同一注释的规则已存在且 IP 相同时跳过，IP 变化时在同一次写入中删除旧 IP 的规则
+    if not rules:
+        return []
+    if not has_cmd("ufw"):
+        return ["ufw未安装"]
+    if not rules_writable():
+        return [allow_docker(c, port, proto) if c else allow_port(port, proto) for port, proto, c in rules]
+    tuples = read_tuples(USER_RULES)
+    plain = plain_allows(tuples)
+    plain6 = plain_allows(read_tuples(USER6_RULES))
+    routes = {}
+    for line, f, comment in tuples:
+        if comment and len(f) >= 4 and f[0] == "route:allow":
+            routes.setdefault(comment, {})[f[3]] = line
+    out = []
+    v4 = []
+    v6 = []
+    drop = set()
+    for port, proto, container in rules:
+        if not container:
+            if (str(port), proto) in plain:
+                out.append(f"ufw allow {port}/{proto} 已存在，跳过")
+                continue
+            plain.add((str(port), proto))
+            v4.append(f"{TUPLE_MARK}allow {proto} {port} 0.0.0.0/0 any 0.0.0.0/0 in\n-A ufw-user-input -p {proto} --dport {port} -j ACCEPT")
+            if (str(port), proto) not in plain6:
+                plain6.add((str(port), proto))
+                v6.append(f"{TUPLE_MARK}allow {proto} {port} ::/0 any ::/0 in\n-A ufw6-user-input -p {proto} --dport {port} -j ACCEPT")
+            out.append(f"已添加 ufw allow {port}/{proto}")
+            continue
+        ips = container_ips(container)
+        if not ips:
+            out.append(f"容器 {container} 未运行，跳过 {port}/{proto}")
+            continue
+        comment = f"allow {container} {port}/{proto}"
+        have = routes.setdefault(comment, {})
+        stale = [ip for ip in have if ip not in ips]
+        new = [ip for ip in ips if ip not in have]
+        if not stale and not new:
+            out.append(f"ufw-docker allow {container} {port}/{proto} 已存在，跳过")
+            continue
+        for ip in stale:
+            drop.add(have.pop(ip))
+        for ip in new:
+            line = f"{TUPLE_MARK}route:allow {proto} {port} {ip} any 0.0.0.0/0 in comment={comment.encode('utf-8').hex()}"
+            have[ip] = line
+            v4.append(f"{line}\n-A ufw-user-forward -p {proto} -d {ip} --dport {port} -j ACCEPT")
+        out.append(f"已{'更新' if stale else '添加'} ufw-docker allow {container} {port}/{proto}: {', '.join(ips)}")
+    if not v4 and not v6 and not drop:
+        return out
+    update_rules(USER_RULES, v4, drop)
+    if v6 and os.path.exists(USER6_RULES) and os.access(USER6_RULES, os.W_OK):
+        update_rules(USER6_RULES, v6, set())
+    r = run_cmd(["ufw", "reload"])
+    msg = (r.stdout or r.stderr).strip()
+    if msg:
+        out.append(msg)
+    return out
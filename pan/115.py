@@ -4,10 +4,11 @@
 "扫码获取 115 cookie"
 
 __author__ = "ChenyangGao <https://chenyanggao.github.io>"
-__version__ = (0, 0, 2)
+__version__ = (0, 0, 3)
 __all__ = [
-    "AppEnum", "get_qrcode_token", "get_qrcode_status", "post_qrcode_result", 
-    "get_qrcode", "login_with_qrcode", 
+    "AppEnum", "CookieStore", "HTTPStatusError", "P115Client", "AsyncP115Client", "QrcodePoller",
+    "get_qrcode_token", "get_qrcode_status", "post_qrcode_result",
+    "get_qrcode", "login_with_qrcode", "login_with_qrcode_many",
 ]
 
 if __name__ == "__main__":
@@ -18,23 +19,46 @@ if __name__ == "__main__":
 默认在命令行输出，需要安装 qrcode: pip install qrcode
     - https://pypi.org/project/qrcode/
 可以指定 -o 或 --open-qrcode 直接打开图片扫码
+可以同时指定多个 app，会并发地为每个 app 生成二维码并等待扫码
 """, formatter_class=RawTextHelpFormatter)
-    parser.add_argument("app", nargs="?", choices=("web", "android", "ios", "linux", "mac", "windows", "tv", "alipaymini", "wechatmini", "qandroid"), default="web", help="选择一个 app 进行登录，注意：这会把已经登录的相同 app 踢下线")
+    parser.add_argument("app", nargs="*", choices=("web", "android", "ios", "linux", "mac", "windows", "tv", "alipaymini", "wechatmini", "qandroid"), default="web", help="选择一个或多个 app 进行登录，注意：这会把已经登录的相同 app 踢下线")
     parser.add_argument("-o", "--open-qrcode", action="store_true", help="打开二维码图片，而不是在命令行输出")
+    parser.add_argument("-a", "--account", default="default", help="账号名，用于区分本地保存的 cookie，默认 default")
+    parser.add_argument("-f", "--force", action="store_true", help="忽略本地保存的 cookie，强制重新扫码登录")
+    parser.add_argument("-s", "--cookie-store", help="cookie 保存路径，默认 $P115_COOKIE_STORE 或 ~/.config/115/cookies.json")
     parser.add_argument("-v", "--version", action="store_true", help="输出版本号")
     args = parser.parse_args()
     if args.version:
         print(".".join(map(str, __version__)))
         raise SystemExit(0)
 
+import asyncio
+import os
+import ssl
+
 from enum import Enum
-from json import loads
-from urllib.parse import urlencode
-from urllib.request import urlopen, Request
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from io import BytesIO
+from json import dump, loads
+from random import uniform
+from tempfile import NamedTemporaryFile
+from time import monotonic, sleep, time
+from urllib.parse import urlencode, urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 AppEnum = Enum("AppEnum", "web, android, ios, linux, mac, windows, tv, alipaymini, wechatmini, qandroid")
 
+QRCODE_API = "https://qrcodeapi.115.com"
+PASSPORT_API = "https://passportapi.115.com"
+USER_API = "https://my.115.com"
+COOKIE_STORE = os.environ.get("P115_COOKIE_STORE") or os.path.expanduser("~/.config/115/cookies.json")
+USER_AGENT = "Mozilla/5.0"
+
 
 def get_enum_name(val, cls):
     if isinstance(val, cls):
@@ -47,13 +71,630 @@ def get_enum_name(val, cls):
     return cls(val).name
 
 
+def backoff(attempt, base=0.5, cap=10.0):
+    """full jitter 退避：在 [0, min(cap, base * 2 ** attempt)] 之间随机取一个等待秒数
+    """
+    return uniform(0, min(cap, base * 2 ** attempt))
+
+
+class HTTPStatusError(OSError):
+    """服务端返回 4xx/5xx 状态码
+
+    :param status: HTTP 状态码
+    """
+
+    def __init__(self, method, url, status, content):
+        super().__init__("%s %s: %s %r" % (method, url, status, content[:200]))
+        self.status = status
+
+
+class QrcodePoller:
+    """二维码状态轮询的节奏控制，同步和异步客户端共用
+
+    `get/status` 是长轮询接口：状态不变时服务端会挂起请求一段时间再返回，
+    这种情况下应立即发起下一次请求；如果很快就返回了相同的状态（服务端没有挂起），
+    或者请求出错，则按 full jitter 指数退避等待，避免空转和大量账号同时重试。
+
+    :param min_interval: 响应耗时低于该秒数、且状态未变化时视为"快速返回"，需要退避
+    :param max_delay: 单次退避的最大秒数
+    :param max_errors: 连续出错超过该次数后放弃轮询，抛出最后一次的异常
+    :param on_status: 状态变化时的回调，参数为 (status, resp)，默认打印到命令行
+    """
+
+    def __init__(self, min_interval=1.0, max_delay=10.0, max_errors=10, on_status=None):
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self.max_errors = max_errors
+        self.on_status = on_status or print_status
+        self.attempt = 0
+        self.errors = 0
+        self.status = None
+
+    def on_response(self, resp, elapsed):
+        """处理一次状态响应
+        :return: 下一次请求前需要等待的秒数；返回 None 表示已登录，可以获取结果
+        :raise OSError: 二维码已过期、已取消或出现未知状态
+        """
+        self.errors = 0
+        status = resp["data"].get("status")
+        changed = status != self.status
+        self.status = status
+        if changed:
+            self.on_status(status, resp)
+        if status == 2:
+            return None
+        elif status == -1:
+            raise OSError("[status=-1] qrcode: expired")
+        elif status == -2:
+            raise OSError("[status=-2] qrcode: canceled")
+        elif status not in (0, 1):
+            raise OSError("qrcode: aborted with %r" % resp)
+        if changed or elapsed >= self.min_interval:
+            self.attempt = 0
+            return 0
+        self.attempt += 1
+        return backoff(self.attempt, self.min_interval / 2, self.max_delay)
+
+    def on_timeout(self):
+        """长轮询超时是正常情况，只加一点抖动后重试
+        """
+        self.attempt = 0
+        return backoff(0, self.min_interval / 2, self.max_delay)
+
+    def on_error(self, exc):
+        """连接失败等错误，指数退避后重试
+        :raise: 4xx（uid 无效或已失效，重试也不会成功）或连续出错超过 `max_errors` 次时抛出 `exc`
+        """
+        self.errors += 1
+        if isinstance(exc, HTTPStatusError) and exc.status < 500 or self.errors > self.max_errors:
+            raise exc
+        self.attempt += 1
+        return backoff(self.attempt, self.min_interval / 2, self.max_delay)
+
+
+class CookieStore:
+    """本地 cookie 存储，按 账号 -> app 保存扫码登录结果以及最近一次确认有效的时间
+
+    文件格式为 JSON：{account: {app: {"resp": 登录结果, "created": 时间戳, "verified": 时间戳}}}，
+    每次修改都先写临时文件再 rename，多个进程同时读写时不会读到半个文件
+
+    :param path: 保存路径，默认 $P115_COOKIE_STORE 或 ~/.config/115/cookies.json
+    """
+
+    def __init__(self, path=None):
+        self.path = path or COOKIE_STORE
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return loads(f.read() or "{}")
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _update(self, fn):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # 读-改-写期间持有锁，避免多个进程同时登录时互相覆盖
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.load()
+            fn(data)
+            with NamedTemporaryFile("w", encoding="utf-8", dir=directory, prefix=".cookies-", delete=False) as f:
+                dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(f.name, 0o600)
+            os.replace(f.name, self.path)
+
+    def get(self, account, app):
+        """:return: dict 或 None，包含 resp、created、verified
+        """
+        return self.load().get(account, {}).get(get_enum_name(app, AppEnum))
+
+    def set(self, account, app, resp):
+        now = time()
+        app = get_enum_name(app, AppEnum)
+        self._update(lambda data: data.setdefault(account, {}).__setitem__(app, {"resp": resp, "created": now, "verified": now}))
+
+    def touch(self, account, app):
+        """记录 cookie 刚刚确认有效
+        """
+        app = get_enum_name(app, AppEnum)
+        def fn(data):
+            entry = data.get(account, {}).get(app)
+            if entry:
+                entry["verified"] = time()
+        self._update(fn)
+
+    def remove(self, account, app):
+        app = get_enum_name(app, AppEnum)
+        self._update(lambda data: data.get(account, {}).pop(app, None))
+
+
+def format_cookie(resp):
+    return "; ".join("%s=%s" % t for t in resp["data"]["cookie"].items())
+
+
+def print_status(status, resp):
+    if status == 0:
+        print("[status=0] qrcode: waiting")
+    elif status == 1:
+        print("[status=1] qrcode: scanned")
+    elif status == 2:
+        print("[status=2] qrcode: signed in")
+
+
+def show_qrcode(qrcode, image=None):
+    """展示二维码
+    :param qrcode: 二维码的文本内容，取自 `get_qrcode_token` 接口响应
+    :param image: 二维码图片的字节数据，为 None 时在命令行输出，否则保存为临时文件并打开
+    """
+    if image is None:
+        try:
+            from qrcode import QRCode
+        except ModuleNotFoundError:
+            from sys import executable
+            from subprocess import run
+            run([executable, "-m", "pip", "install", "qrcode"], check=True)
+            from qrcode import QRCode # type: ignore
+        qr = QRCode(border=1)
+        qr.add_data(qrcode)
+        qr.print_ascii(tty=True)
+    else:
+        from atexit import register
+        from os import remove
+        from threading import Thread
+        from tempfile import NamedTemporaryFile
+        with NamedTemporaryFile(suffix=".png", delete=False) as f:
+            f.write(image)
+            f.flush()
+        register(lambda: remove(f.name))
+        def open_qrcode():
+            platform = __import__("platform").system()
+            if platform == "Windows":
+                from os import startfile # type: ignore
+                startfile(f.name)
+            elif platform == "Darwin":
+                from subprocess import run
+                run(["open", f.name])
+            else:
+                from subprocess import run
+                run(["xdg-open", f.name])
+        Thread(target=open_qrcode).start()
+
+
+class P115Client:
+    """115 扫码登录客户端，每个 host 保持一条 keep-alive 连接，多次请求复用同一次 TLS 握手
+
+    实例不是线程安全的，多个账号并发登录请使用 `AsyncP115Client`，或者每个线程各用一个实例
+
+    :param qrcode_api: 二维码接口的根地址，测试时可以指向本地的 http 服务
+    :param passport_api: 登录接口的根地址，测试时可以指向本地的 http 服务
+    :param timeout: 单次请求的超时秒数，应大于 `get/status` 长轮询的挂起时间
+    :param poller: 返回 `QrcodePoller` 的工厂函数，用于定制轮询节奏
+    :param user_api: 用于检查 cookie 是否有效的接口根地址
+    :param store: `CookieStore`，为 False 时不读写本地 cookie
+    :param verify_interval: 距上次确认有效不超过该秒数的 cookie 直接使用，超过则先联网检查
+    """
+
+    def __init__(self, qrcode_api=QRCODE_API, passport_api=PASSPORT_API, timeout=60, poller=QrcodePoller,
+                 user_api=USER_API, store=None, verify_interval=3600):
+        self.qrcode_api = qrcode_api.rstrip("/")
+        self.passport_api = passport_api.rstrip("/")
+        self.user_api = user_api.rstrip("/")
+        self.timeout = timeout
+        self.poller = poller
+        self.store = CookieStore() if store is None else store
+        self.verify_interval = verify_interval
+        self._conns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+
+    def _drop(self, key):
+        conn = self._conns.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+    def request(self, method, url, data=None, cookie=None):
+        """发送请求并返回响应体
+        :param data: dict，作为表单提交
+        :param cookie: dict，随请求发送的 cookie
+        :return: bytes
+        """
+        u = urlsplit(url)
+        key = (u.scheme, u.netloc)
+        path = (u.path or "/") + ("?" + u.query if u.query else "")
+        headers = {"User-Agent": USER_AGENT, "Connection": "keep-alive"}
+        if cookie:
+            headers["Cookie"] = "; ".join("%s=%s" % t for t in cookie.items())
+        body = None
+        if data is not None:
+            body = urlencode(data).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        while True:
+            conn = self._conns.get(key)
+            reused = conn is not None
+            if conn is None:
+                cls = HTTPSConnection if u.scheme == "https" else HTTPConnection
+                conn = self._conns[key] = cls(u.netloc, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                content = resp.read()
+            except TimeoutError:
+                self._drop(key)
+                raise
+            except (HTTPException, ConnectionError):
+                self._drop(key)
+                # 复用的连接可能已被服务端关闭，此时重新建立连接再试一次
+                if reused:
+                    continue
+                raise
+            if resp.will_close:
+                self._drop(key)
+            if resp.status >= 400:
+                raise HTTPStatusError(method, url, resp.status, content)
+            return content
+
+    def get_qrcode_token(self):
+        """获取登录二维码，扫码可用
+        GET https://qrcodeapi.115.com/api/1.0/web/1.0/token/
+        :return: dict
+        """
+        return loads(self.request("GET", self.qrcode_api + "/api/1.0/web/1.0/token/"))
+
+    def get_qrcode_status(self, payload):
+        """获取二维码的状态（未扫描、已扫描、已登录、已取消、已过期等）
+        GET https://qrcodeapi.115.com/get/status/
+        :param payload: 请求的查询参数，取自 `get_qrcode_token` 接口响应，有 3 个
+            - uid:  str
+            - time: int
+            - sign: str
+        :return: dict
+        """
+        return loads(self.request("GET", self.qrcode_api + "/get/status/?" + urlencode(payload)))
+
+    def post_qrcode_result(self, uid, app="web"):
+        """获取扫码登录的结果，并且绑定设备，包含 cookie
+        POST https://passportapi.115.com/app/1.0/{app}/1.0/login/qrcode/
+        :param uid: 二维码的 uid，取自 `get_qrcode_token` 接口响应
+        :param app: 扫码绑定的设备，可以是 int、str 或者 AppEnum，可用值见 `post_qrcode_result`
+        :return: dict，包含 cookie
+        """
+        app = get_enum_name(app, AppEnum)
+        api = self.passport_api + "/app/1.0/%s/1.0/login/qrcode/" % app
+        return loads(self.request("POST", api, {"app": app, "account": uid}))
+
+    def get_qrcode(self, uid):
+        """获取二维码图片（注意不是链接）
+        :return: bytes
+        """
+        return self.request("GET", self.qrcode_api + "/api/1.0/mac/1.0/qrcode?uid=%s" % uid)
+
+    def wait_qrcode(self, payload):
+        """轮询二维码状态直到登录成功
+        :param payload: 取自 `get_qrcode_token` 接口响应
+        :raise OSError: 二维码已过期或已取消、接口返回 4xx，或连续出错次数过多
+        """
+        poller = self.poller()
+        while True:
+            start = monotonic()
+            try:
+                resp = self.get_qrcode_status(payload)
+            except TimeoutError:
+                delay = poller.on_timeout()
+            except (OSError, HTTPException, ValueError) as e:
+                delay = poller.on_error(e)
+            else:
+                delay = poller.on_response(resp, monotonic() - start)
+                if delay is None:
+                    return
+            if delay:
+                sleep(delay)
+
+    def check_cookie(self, cookie):
+        """检查 cookie 是否仍然处于登录状态
+        GET https://my.115.com/?ct=guide&ac=status
+        :return: bool
+        :raise OSError: 网络错误；响应无法解析时抛出 ValueError，两者都不代表 cookie 已失效
+        """
+        return bool(loads(self.request("GET", self.user_api + "/?ct=guide&ac=status", cookie=cookie)).get("state"))
+
+    def cached_login(self, account, app):
+        """取本地保存的登录结果，超过 `verify_interval` 未确认时先联网检查
+        :return: dict 或 None
+        """
+        if not self.store:
+            return None
+        entry = self.store.get(account, app)
+        if not entry:
+            return None
+        if time() - entry["verified"] < self.verify_interval:
+            return entry["resp"]
+        try:
+            valid = self.check_cookie(entry["resp"]["data"]["cookie"])
+        except (OSError, HTTPException, ValueError):
+            # 暂时无法确认时沿用本地 cookie 且不更新确认时间，下次再检查；
+            # 此时改为扫码会把很可能仍然有效的会话踢下线
+            return entry["resp"]
+        if valid:
+            self.store.touch(account, app)
+            return entry["resp"]
+        self.store.remove(account, app)
+        return None
+
+    def login_with_qrcode(self, app="web", scan_in_console=True, account="default", force=False):
+        """用二维码登录，本地已保存且仍然有效的 cookie 会直接返回，不再扫码
+        :param app: 扫码绑定的设备，可以是 int、str 或者 AppEnum，可用值见 `post_qrcode_result`
+        :param scan_in_console: 为 True 时在命令行输出二维码，否则打开二维码图片
+        :param account: 账号名，用于区分本地保存的 cookie
+        :param force: 为 True 时忽略本地保存的 cookie，强制重新扫码
+        :return: dict，扫码登录结果
+        """
+        if not force:
+            resp = self.cached_login(account, app)
+            if resp is not None:
+                return resp
+        qrcode_token = self.get_qrcode_token()["data"]
+        qrcode = qrcode_token.pop("qrcode")
+        show_qrcode(qrcode, None if scan_in_console else self.get_qrcode(qrcode_token["uid"]))
+        self.wait_qrcode(qrcode_token)
+        resp = self.post_qrcode_result(qrcode_token["uid"], app)
+        if self.store:
+            self.store.set(account, app, resp)
+        return resp
+
+
+class AsyncP115Client:
+    """`P115Client` 的 asyncio 版本，基于 `asyncio.open_connection` 实现 HTTP/1.1 keep-alive，
+    一个进程可以同时为很多账号或 app 驱动扫码登录，等待扫码时不占用线程
+
+    参数与 `P115Client` 相同；同一实例上的请求会串行执行，并发登录请为每个账号各建一个实例
+    """
+
+    def __init__(self, qrcode_api=QRCODE_API, passport_api=PASSPORT_API, timeout=60, poller=QrcodePoller,
+                 user_api=USER_API, store=None, verify_interval=3600):
+        self.qrcode_api = qrcode_api.rstrip("/")
+        self.passport_api = passport_api.rstrip("/")
+        self.user_api = user_api.rstrip("/")
+        self.timeout = timeout
+        self.poller = poller
+        self.store = CookieStore() if store is None else store
+        self.verify_interval = verify_interval
+        self._conns = {}
+        self._lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        for key in list(self._conns):
+            await self._drop(key)
+
+    async def _drop(self, key):
+        conn = self._conns.pop(key, None)
+        if conn is not None:
+            conn[1].close()
+            try:
+                await conn[1].wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        status = int(status_line.split(None, 2)[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, body
+
+    async def request(self, method, url, data=None, cookie=None):
+        """发送请求并返回响应体
+        :param data: dict，作为表单提交
+        :param cookie: dict，随请求发送的 cookie
+        :return: bytes
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        u = urlsplit(url)
+        key = (u.scheme, u.netloc)
+        path = (u.path or "/") + ("?" + u.query if u.query else "")
+        body = b"" if data is None else urlencode(data).encode("utf-8")
+        head = "%s %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n" % (method, path, u.netloc, USER_AGENT)
+        if cookie:
+            head += "Cookie: %s\r\n" % "; ".join("%s=%s" % t for t in cookie.items())
+        if data is not None:
+            head += "Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n" % len(body)
+        async with self._lock:
+            while True:
+                conn = self._conns.get(key)
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        https = u.scheme == "https"
+                        conn = self._conns[key] = await asyncio.wait_for(asyncio.open_connection(
+                            u.hostname, u.port or (443 if https else 80), ssl=ssl.create_default_context() if https else None
+                        ), self.timeout)
+                    reader, writer = conn
+                    writer.write(head.encode("latin-1") + b"\r\n" + body)
+                    await writer.drain()
+                    status, headers, content = await asyncio.wait_for(self._read_response(reader), self.timeout)
+                except (TimeoutError, asyncio.TimeoutError):
+                    # Python 3.10 的 asyncio.wait_for 抛出的 asyncio.TimeoutError 不是 TimeoutError 的子类
+                    await self._drop(key)
+                    raise
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await self._drop(key)
+                    # 复用的连接可能已被服务端关闭，此时重新建立连接再试一次
+                    if reused:
+                        continue
+                    raise
+                if headers.get("connection", "").lower() == "close":
+                    await self._drop(key)
+                if status >= 400:
+                    raise HTTPStatusError(method, url, status, content)
+                return content
+
+    async def get_qrcode_token(self):
+        """见 `P115Client.get_qrcode_token`
+        """
+        return loads(await self.request("GET", self.qrcode_api + "/api/1.0/web/1.0/token/"))
+
+    async def get_qrcode_status(self, payload):
+        """见 `P115Client.get_qrcode_status`
+        """
+        return loads(await self.request("GET", self.qrcode_api + "/get/status/?" + urlencode(payload)))
+
+    async def post_qrcode_result(self, uid, app="web"):
+        """见 `P115Client.post_qrcode_result`
+        """
+        app = get_enum_name(app, AppEnum)
+        api = self.passport_api + "/app/1.0/%s/1.0/login/qrcode/" % app
+        return loads(await self.request("POST", api, {"app": app, "account": uid}))
+
+    async def get_qrcode(self, uid):
+        """见 `P115Client.get_qrcode`
+        """
+        return await self.request("GET", self.qrcode_api + "/api/1.0/mac/1.0/qrcode?uid=%s" % uid)
+
+    async def wait_qrcode(self, payload):
+        """见 `P115Client.wait_qrcode`
+        """
+        poller = self.poller()
+        while True:
+            start = monotonic()
+            try:
+                resp = await self.get_qrcode_status(payload)
+            except (TimeoutError, asyncio.TimeoutError):
+                delay = poller.on_timeout()
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                delay = poller.on_error(e)
+            else:
+                delay = poller.on_response(resp, monotonic() - start)
+                if delay is None:
+                    return
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def check_cookie(self, cookie):
+        """见 `P115Client.check_cookie`
+        """
+        return bool(loads(await self.request("GET", self.user_api + "/?ct=guide&ac=status", cookie=cookie)).get("state"))
+
+    async def cached_login(self, account, app):
+        """见 `P115Client.cached_login`
+        """
+        if not self.store:
+            return None
+        entry = self.store.get(account, app)
+        if not entry:
+            return None
+        if time() - entry["verified"] < self.verify_interval:
+            return entry["resp"]
+        try:
+            valid = await self.check_cookie(entry["resp"]["data"]["cookie"])
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return entry["resp"]
+        if valid:
+            self.store.touch(account, app)
+            return entry["resp"]
+        self.store.remove(account, app)
+        return None
+
+    async def login_with_qrcode(self, app="web", scan_in_console=True, account="default", force=False, show=show_qrcode):
+        """见 `P115Client.login_with_qrcode`
+        :param show: 展示二维码的函数，参数为 (qrcode, image)，同 `show_qrcode`
+        """
+        if not force:
+            resp = await self.cached_login(account, app)
+            if resp is not None:
+                return resp
+        qrcode_token = (await self.get_qrcode_token())["data"]
+        qrcode = qrcode_token.pop("qrcode")
+        show(qrcode, None if scan_in_console else await self.get_qrcode(qrcode_token["uid"]))
+        await self.wait_qrcode(qrcode_token)
+        resp = await self.post_qrcode_result(qrcode_token["uid"], app)
+        if self.store:
+            self.store.set(account, app, resp)
+        return resp
+
+
+async def login_with_qrcode_many(apps, scan_in_console=True, force=False, **client_kwargs):
+    """同时为多个 app（或多个账号）扫码登录，每个登录使用独立的 `AsyncP115Client`
+    :param apps: 列表，每项是 app（账号名为 default）或者 (账号名, app)，app 可用值见 `post_qrcode_result`
+    :param force: 为 True 时忽略本地保存的 cookie，强制重新扫码
+    :param client_kwargs: 传给 `AsyncP115Client` 的参数
+    :return: list，与 apps 一一对应的登录结果，失败的项为对应的异常
+    """
+    async def login(item):
+        account, app = item if isinstance(item, tuple) else ("default", item)
+        name = get_enum_name(app, AppEnum)
+        if account != "default":
+            name = "%s/%s" % (account, name)
+        def show(qrcode, image):
+            print("[%s] 请扫码登录" % name)
+            show_qrcode(qrcode, image)
+        def on_status(status, resp):
+            print("[%s] " % name, end="")
+            print_status(status, resp)
+        kwargs = dict(client_kwargs)
+        kwargs.setdefault("poller", lambda: QrcodePoller(on_status=on_status))
+        async with AsyncP115Client(**kwargs) as client:
+            return await client.login_with_qrcode(app, scan_in_console, account, force, show)
+    return await asyncio.gather(*map(login, apps), return_exceptions=True)
+
+
+_client = None
+
+
+def _default_client():
+    global _client
+    if _client is None:
+        _client = P115Client()
+    return _client
+
+
 def get_qrcode_token():
     """获取登录二维码，扫码可用
     GET https://qrcodeapi.115.com/api/1.0/web/1.0/token/
     :return: dict
     """
-    api = "https://qrcodeapi.115.com/api/1.0/web/1.0/token/"
-    return loads(urlopen(api).read())
+    return _default_client().get_qrcode_token()
 
 
 def get_qrcode_status(payload):
@@ -65,8 +706,7 @@ def get_qrcode_status(payload):
         - sign: str
     :return: dict
     """
-    api = "https://qrcodeapi.115.com/get/status/?" + urlencode(payload)
-    return loads(urlopen(api).read())
+    return _default_client().get_qrcode_status(payload)
 
 
 def post_qrcode_result(uid, app="web"):
@@ -87,22 +727,18 @@ def post_qrcode_result(uid, app="web"):
             - 10, "qandroid",   AppEnum.qandroid
     :return: dict，包含 cookie
     """
-    app = get_enum_name(app, AppEnum)
-    payload = {"app": app, "account": uid}
-    api = "https://passportapi.115.com/app/1.0/%s/1.0/login/qrcode/" % app
-    return loads(urlopen(Request(api, data=urlencode(payload).encode("utf-8"), method="POST")).read())
+    return _default_client().post_qrcode_result(uid, app)
 
 
 def get_qrcode(uid):
     """获取二维码图片（注意不是链接）
     :return: 一个文件对象，可以读取
     """
-    url = "https://qrcodeapi.115.com/api/1.0/mac/1.0/qrcode?uid=%s" % uid
-    return urlopen(url)
+    return BytesIO(_default_client().get_qrcode(uid))
 
 
-def login_with_qrcode(app="web", scan_in_console=True):
-    """用二维码登录
+def login_with_qrcode(app="web", scan_in_console=True, account="default", force=False):
+    """用二维码登录，本地已保存且仍然有效的 cookie 会直接返回，不再扫码
     :param app: 扫码绑定的设备，可以是 int、str 或者 AppEnum
         app 目前发现的可用值：
             - 1,  "web",        AppEnum.web
@@ -115,66 +751,29 @@ def login_with_qrcode(app="web", scan_in_console=True):
             - 8,  "alipaymini", AppEnum.alipaymini
             - 9,  "wechatmini", AppEnum.wechatmini
             - 10, "qandroid",   AppEnum.qandroid
+    :param account: 账号名，用于区分本地保存的 cookie
+    :param force: 为 True 时忽略本地保存的 cookie，强制重新扫码
     :return: dict，扫码登录结果
     """
-    qrcode_token = get_qrcode_token()["data"]
-    qrcode = qrcode_token.pop("qrcode")
-    if scan_in_console:
-        try:
-            from qrcode import QRCode
-        except ModuleNotFoundError:
-            from sys import executable
-            from subprocess import run
-            run([executable, "-m", "pip", "install", "qrcode"], check=True)
-            from qrcode import QRCode # type: ignore
-        qr = QRCode(border=1)
-        qr.add_data(qrcode)
-        qr.print_ascii(tty=True)
-    else:
-        from atexit import register
-        from os import remove
-        from threading import Thread
-        from tempfile import NamedTemporaryFile
-        qrcode_image = get_qrcode(qrcode_token["uid"])
-        with NamedTemporaryFile(suffix=".png", delete=False) as f:
-            f.write(qrcode_image.read())
-            f.flush()
-        register(lambda: remove(f.name))
-        def open_qrcode():
-            platform = __import__("platform").system()
-            if platform == "Windows":
-                from os import startfile # type: ignore
-                startfile(f.name)
-            elif platform == "Darwin":
-                from subprocess import run
-                run(["open", f.name])
-            else:
-                from subprocess import run
-                run(["xdg-open", f.name])
-        Thread(target=open_qrcode).start()
-    while True:
-        try:
-            resp = get_qrcode_status(qrcode_token)
-        except TimeoutError:
-            continue
-        status = resp["data"].get("status")
-        if status == 0:
-            print("[status=0] qrcode: waiting")
-        elif status == 1:
-            print("[status=1] qrcode: scanned")
-        elif status == 2:
-            print("[status=2] qrcode: signed in")
-            break
-        elif status == -1:
-            raise OSError("[status=-1] qrcode: expired")
-        elif status == -2:
-            raise OSError("[status=-2] qrcode: canceled")
-        else:
-            raise OSError("qrcode: aborted with %r" % resp)
-    return post_qrcode_result(qrcode_token["uid"], app)
+    return _default_client().login_with_qrcode(app, scan_in_console, account, force)
 
 
 if __name__ == "__main__":
-    resp = login_with_qrcode(args.app, scan_in_console=not args.open_qrcode)
-    print()
-    print("; ".join("%s=%s" % t for t in resp['data']['cookie'].items()))
\ No newline at end of file
+    if isinstance(args.app, str):
+        args.app = [args.app]
+    store = CookieStore(args.cookie_store)
+    if len(args.app) == 1:
+        client = P115Client(store=store)
+        resp = client.login_with_qrcode(args.app[0], scan_in_console=not args.open_qrcode, account=args.account, force=args.force)
+        print()
+        print(format_cookie(resp))
+    else:
+        results = asyncio.run(login_with_qrcode_many(
+            [(args.account, app) for app in args.app], scan_in_console=not args.open_qrcode, force=args.force, store=store,
+        ))
+        print()
+        for app, resp in zip(args.app, results):
+            if isinstance(resp, BaseException):
+                print("%s: 登录失败 %s" % (app, resp))
+            else:
+                print("%s: %s" % (app, format_cookie(resp)))